@@ -4,7 +4,9 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 from vcf2db import VCFDB, get_dburl, clean
 import atexit
+import sqlite3
 import sqlalchemy as sql
+import numpy as np
 
 vcf = "tests/test.vcf"
 ped = "tests/test.ped"
@@ -67,6 +69,521 @@ def test_load():
     yield check_cap, metadata
     yield check_sample_genotype_counts, metadata
 
+def test_update_annotations():
+    db = "tests/xx-update.db"
+    VCFDB(vcf, db, ped, gene_summary=True)
+    eng = sql.create_engine(get_dburl(db))
+    genes = [x[0] for x in eng.execute("select gene from variants order by variant_id")]
+    n_impacts, = next(iter(eng.execute("select count(*) from variant_impacts")))
+    eng.execute("update variants set gene = NULL")
+
+    VCFDB(vcf, db, update_annotations="position")
+
+    metadata = sql.MetaData(bind=eng)
+    metadata.reflect()
+
+    res, = next(iter(eng.execute("select count(*) from variant_impacts")))
+    assert res == n_impacts, (res, n_impacts)
+    obs = [x[0] for x in eng.execute("select gene from variants order by variant_id")]
+    assert obs == genes, obs
+    # it would be stale.
+    assert "gene_summary" not in metadata.tables
+
+    yield check_header, metadata
+    yield check_variants, metadata
+    yield check_aaf, metadata
+    yield check_cap, metadata
+
+def test_update_annotations_order():
+    db = "tests/xx-update.db"
+    VCFDB(vcf, db, ped)
+    eng = sql.create_engine(get_dburl(db))
+    genes = [x[0] for x in eng.execute("select gene from variants order by variant_id")]
+    eng.execute("update variants set gene = NULL")
+    VCFDB(vcf, db, update_annotations="order")
+    obs = [x[0] for x in eng.execute("select gene from variants order by variant_id")]
+    assert obs == genes, obs
+
+    # a VCF with a record missing doesn't match the order of the database.
+    lines = open(vcf).readlines()
+    first = [k for k, l in enumerate(lines) if l[0] != "#"][0]
+    missing = "tests/xx-missing.vcf"
+    with open(missing, "w") as fh:
+        fh.writelines(lines[:first] + lines[first + 1:])
+    atexit.register(rm, missing)
+    try:
+        VCFDB(missing, db, update_annotations="order")
+    except Exception as e:
+        assert "does not match" in str(e), e
+    else:
+        assert False, "expected an error for the out of order variants"
+
+    # nor does one that is missing its last record.
+    with open(missing, "w") as fh:
+        fh.writelines(lines[:-1])
+    try:
+        VCFDB(missing, db, update_annotations="order")
+    except Exception as e:
+        assert "ended before" in str(e), e
+    else:
+        assert False, "expected an error for the missing variant"
+
+def test_dedup_blobs():
+    db_dedup = "tests/xx-dedup.db"
+    VCFDB(vcf, db, ped)
+    VCFDB(vcf, db_dedup, ped, dedup_blobs=VCFDB.gt_cols)
+
+    qry = "select * from variants order by variant_id"
+    expected = list(sql.create_engine(get_dburl(db)).execute(qry))
+    eng = sql.create_engine(get_dburl(db_dedup))
+    obs = list(eng.execute(qry))
+    assert [tuple(r) for r in obs] == [tuple(r) for r in expected]
+
+    n_blobs, = next(iter(eng.execute("select count(*) from genotype_blobs")))
+    assert n_blobs < len(VCFDB.gt_cols) * n_variants, n_blobs
+
+def test_clustered():
+    db_clustered = "tests/xx-clustered.db"
+    qv = "select * from variants order by variant_id"
+    qi = "select variant_id, gene, transcript, impact from variant_impacts"
+    VCFDB(vcf, db, ped)
+    eng = sql.create_engine(get_dburl(db))
+    expected, expected_impacts = list(eng.execute(qv)), sorted(eng.execute(qi))
+
+    for dedup in (None, ["gt_types"]):
+        VCFDB(vcf, db_clustered, ped, clustered=True, dedup_blobs=dedup)
+        eng = sql.create_engine(get_dburl(db_clustered))
+        assert list(eng.execute(qv)) == expected
+        assert sorted(eng.execute(qi)) == expected_impacts
+        schema, = next(iter(eng.execute("select sql from sqlite_master where name = 'variant_impacts'")))
+        assert "WITHOUT ROWID" in schema, schema
+
+    # the layout is kept when the annotations are updated.
+    VCFDB(vcf, db_clustered, update_annotations="position")
+    assert list(eng.execute(qv)) == expected
+    assert sorted(eng.execute(qi)) == expected_impacts
+    schema, = next(iter(eng.execute("select sql from sqlite_master where name = 'variant_impacts'")))
+    assert "WITHOUT ROWID" in schema, schema
+
+def test_update_new_column_view():
+    # a new INFO field in the re-annotated VCF is added to variants_data and the view.
+    lines = open(vcf).readlines()
+    k = [i for i, l in enumerate(lines) if l.startswith("##INFO")][0]
+    lines.insert(k, '##INFO=<ID=NEWF,Number=1,Type=Integer,Description="new field">\n')
+    lines = [l if l[0] == "#" else l.replace("\tAC=", "\tNEWF=3;AC=", 1) for l in lines]
+    newf = "tests/xx-newf.vcf"
+    with open(newf, "w") as fh:
+        fh.writelines(lines)
+    atexit.register(rm, newf)
+
+    db_view = "tests/xx-view.db"
+    for kwargs in (dict(dedup_blobs=["gt_types"]), dict(clustered=True)):
+        VCFDB(vcf, db_view, ped, **kwargs)
+        eng = sql.create_engine(get_dburl(db_view))
+        expected = list(eng.execute("select * from variants order by variant_id"))
+        VCFDB(newf, db_view, update_annotations="position")
+        obs = list(eng.execute("select * from variants order by variant_id"))
+        assert [r["newf"] for r in obs] == [3] * n_variants, kwargs
+        assert [tuple(r)[:-1] for r in obs] == [tuple(r) for r in expected], kwargs
+
+def test_sparse_info():
+    db_sparse = "tests/xx-sparse.db"
+    qv = "select * from variants order by variant_id"
+    VCFDB(vcf, db, ped)
+    eng = sql.create_engine(get_dburl(db))
+    expected = list(eng.execute(qv))
+
+    VCFDB(vcf, db_sparse, ped, sparse_info=0.5)
+    eng = sql.create_engine(get_dburl(db_sparse))
+    assert list(eng.execute(qv)) == expected
+    fields = dict(eng.execute("select name, field_id from info_fields").fetchall())
+    assert "max_aaf_all" in fields and not "dp" in fields, fields
+    columns = [c["name"] for c in sql.inspect(eng).get_columns("variants_data")]
+    assert not "max_aaf_all" in columns
+    n, = next(iter(eng.execute("select count(*) from variant_info_sparse")))
+    assert n > 0
+
+    # the values stay with their variants when the VCFs are loaded in parallel.
+    header = [l for l in open(vcf) if l[0] == "#"]
+    records = [l for l in open(vcf) if l[0] != "#"]
+    parts = []
+    for k in range(3):
+        parts.append("tests/xx-sparse-part%d.vcf" % k)
+        with open(parts[-1], "w") as fh:
+            fh.writelines(header + records[k * 2:(k + 1) * 2])
+        atexit.register(rm, parts[-1])
+    VCFDB(parts, db_sparse, ped, sparse_info=0.5, vcf_processes=2)
+    assert list(eng.execute(qv)) == expected
+
+    # impacts_extras are kept as columns so they are copied to variant_impacts.
+    qi = "select variant_id, gene, transcript, baseqranksum from variant_impacts"
+    VCFDB(vcf, db, ped, impacts_extras=["BaseQRankSum"])
+    expected = sorted(sql.create_engine(get_dburl(db)).execute(qi))
+    VCFDB(vcf, db_sparse, ped, sparse_info=0.5, impacts_extras=["BaseQRankSum"])
+    assert sorted(eng.execute(qi)) == expected
+    assert [r for r in expected if r[-1] is not None]
+
+def test_genotype_bitmaps():
+    from vcf2db import genotype_bitmap_query
+    from cyvcf2 import VCF
+    VCFDB(vcf, db, ped, genotype_bitmaps=True)
+    v = VCF(vcf)
+    samples = v.samples
+    gts = np.array([np.array(r.gt_types) for r in v])
+    eng = sql.create_engine(get_dburl(db))
+
+    obs = genotype_bitmap_query(eng, het=[samples[0]], called=[samples[1]])
+    exp = [i + 1 for i in np.flatnonzero((gts[:, 0] == v.HET) & (gts[:, 1] != v.UNKNOWN))]
+    assert obs == exp, (obs, exp)
+    obs = genotype_bitmap_query(eng, hom_alt=samples[:2])
+    exp = [i + 1 for i in np.flatnonzero((gts[:, :2] == v.HOM_ALT).all(axis=1))]
+    assert obs == exp, (obs, exp)
+
+def test_region_where():
+    from vcf2db import region_where
+    VCFDB(vcf, db, ped)
+    eng = sql.create_engine(get_dburl(db))
+    rows = list(eng.execute("select chrom, start, end from variants"))
+    for chrom, start, end in rows:
+        for qs, qe in ((start, start + 1), (start - 1000, end + 1000), (end, end + 10)):
+            obs = [tuple(r) for r in eng.execute("select chrom, start, end from variants where " +
+                                                 region_where(chrom, qs, qe))]
+            exp = [r for r in rows if r[0] == chrom and r[1] < qe and r[2] > qs]
+            assert sorted(obs) == sorted(exp), (chrom, qs, qe, obs, exp)
+
+    # end is reserved in postgres.
+    from sqlalchemy.dialects import postgresql
+    assert region_where("chr1", 0, 1, postgresql.dialect()).endswith('"end" > 0')
+
+def test_impact_policy():
+    qv = "select variant_id, impact, gene from variants order by variant_id"
+    qi = "select variant_id, impact_severity, biotype from variant_impacts"
+    VCFDB(vcf, db, ped)
+    eng = sql.create_engine(get_dburl(db))
+    expected = list(eng.execute(qv))
+    all_impacts = list(eng.execute(qi))
+
+    VCFDB(vcf, db, ped, impact_policy=dict(top=1))
+    assert list(eng.execute(qv)) == expected
+    obs = list(eng.execute(qi))
+    assert len(obs) == len(set(r[0] for r in all_impacts)) < len(all_impacts), (len(obs), len(all_impacts))
+
+    VCFDB(vcf, db, ped, impact_policy=dict(min_severity="MED"))
+    assert list(eng.execute(qv)) == expected
+    obs = list(eng.execute(qi))
+    assert sorted(obs) == sorted(r for r in all_impacts if r[1] in ("MED", "HIGH"))
+
+def test_sample_qc():
+    from cyvcf2 import VCF
+    VCFDB(vcf, db, ped)
+    v = VCF(vcf)
+    recs = [(np.array(r.gt_types), np.array(r.gt_depths), r.var_subtype) for r in v]
+    gts = np.array([r[0] for r in recs])
+    depths = np.array([r[1] for r in recs])
+    called = gts != v.UNKNOWN
+    nonref = (gts == v.HET) | (gts == v.HOM_ALT)
+    ts = np.array([r[2] == "ts" for r in recs])
+
+    eng = sql.create_engine(get_dburl(db))
+    rows = list(eng.execute("select sample_id, call_rate, mean_depth, n_ts, call_rate_dp10 "
+                            "from sample_qc order by sample_id"))
+    assert len(rows) == gts.shape[1]
+    for i, (sample_id, call_rate, mean_depth, n_ts, dp10) in enumerate(rows):
+        assert sample_id == i + 1
+        assert abs(call_rate - called[:, i].mean()) < 1e-6
+        ok = called[:, i] & (depths[:, i] >= 0)
+        if ok.any():
+            assert abs(mean_depth - depths[ok, i].mean()) < 1e-6, (mean_depth, depths[ok, i])
+        assert n_ts == nonref[ts, i].sum()
+        assert abs(dp10 - (ok & (depths[:, i] >= 10)).mean()) < 1e-6
+
+def test_skip_gt_cols():
+    VCFDB(vcf, db, ped)
+    eng = sql.create_engine(get_dburl(db))
+    expected = list(eng.execute("select gt_types, gt_depths, gt_ref_depths, gt_alt_depths "
+                                "from variants order by variant_id"))
+    db_skip = "tests/xx-skip.db"
+    VCFDB(vcf, db_skip, ped, skip_gt_cols=["gt_quals", "gt_phases"], reader_threads=2)
+    eng = sql.create_engine(get_dburl(db_skip))
+    assert list(eng.execute("select count(*) from variants where gt_quals is not null "
+                            "or gt_phases is not null")) == [(0,)]
+    obs = list(eng.execute("select gt_types, gt_depths, gt_ref_depths, gt_alt_depths "
+                           "from variants order by variant_id"))
+    assert obs == expected
+    rows = list(eng.execute("select mean_gq, mean_depth from sample_qc"))
+    assert rows and all(gq is None for gq, _ in rows)
+    assert any(depth is not None for _, depth in rows)
+
+def test_gene_summary():
+    import zlib
+    import pickle
+    from cyvcf2 import VCF
+    VCFDB(vcf, db, ped, gene_summary=True)
+    v = VCF(vcf)
+    gts = np.array([np.array(r.gt_types) for r in v])
+    carriers = (gts == v.HET) | (gts == v.HOM_ALT)
+
+    eng = sql.create_engine(get_dburl(db))
+    impacts = list(eng.execute("select variant_id, gene, impact_severity, is_lof from variant_impacts"))
+    rows = list(eng.execute("select gene, n_variants, n_high, n_lof, carrier_counts from gene_summary"))
+    assert len(rows) == len(set(r[1] for r in impacts if r[1]))
+    for gene, n_variants, n_high, n_lof, counts in rows:
+        vids = set(r[0] for r in impacts if r[1] == gene)
+        assert n_variants == len(vids)
+        assert n_high == len(set(r[0] for r in impacts if r[1] == gene and r[2] == "HIGH"))
+        assert n_lof == len(set(r[0] for r in impacts if r[1] == gene and r[3]))
+        counts = pickle.loads(zlib.decompress(counts))
+        assert counts.tolist() == carriers[[i - 1 for i in vids]].sum(axis=0).tolist()
+
+def rounded(row):
+    # float sums depend on how the variants were chunked.
+    return tuple(round(x, 6) if isinstance(x, float) else x for x in row)
+
+def test_multiple_vcfs():
+    header = [l for l in open(vcf) if l[0] == "#"]
+    records = [l for l in open(vcf) if l[0] != "#"]
+    parts = []
+    for k in range(3):
+        parts.append("tests/xx-part%d.vcf" % k)
+        with open(parts[-1], "w") as fh:
+            fh.writelines(header + records[k * 2:(k + 1) * 2])
+        atexit.register(rm, parts[-1])
+
+    from vcf2db import genotype_bitmap_query
+    from cyvcf2 import VCF
+    samples = VCF(vcf).samples
+    kwargs = dict(gene_summary=True, genotype_bitmaps=True)
+    VCFDB(vcf, db, ped, **kwargs)
+    expected = {}
+    eng = sql.create_engine(get_dburl(db))
+    for t in ("variants", "variant_impacts", "sample_genotype_counts", "sample_qc", "gene_summary"):
+        expected[t] = [rounded(r) for r in eng.execute("select * from %s" % t)]
+    hets = [genotype_bitmap_query(eng, het=[s]) for s in samples]
+
+    for processes in (1, 2):
+        db_multi = "tests/xx-multi.db"
+        # the workers count the genotypes and pack the blobs (with threads).
+        VCFDB(parts, db_multi, ped, vcf_processes=processes, blob_threads=2, **kwargs)
+        eng = sql.create_engine(get_dburl(db_multi))
+        for t in expected:
+            obs = [rounded(r) for r in eng.execute("select * from %s" % t)]
+            assert sorted(obs) == sorted(expected[t]), (t, processes)
+        assert [genotype_bitmap_query(eng, het=[s]) for s in samples] == hets
+
+class TableConnection(object):
+    "a raw connection whose commit can be made to fail"
+    def __init__(self, conn, fail_commit=False):
+        self.conn, self.fail_commit = conn, fail_commit
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def commit(self):
+        if self.fail_commit:
+            raise sqlite3.OperationalError("disk I/O error")
+        self.conn.commit()
+
+class TableEngines(object):
+    """
+    sqlite allows a single writer so each table is in its own database and
+    insert_tables gets a connection to each in turn from raw_connection.
+    """
+    def __init__(self, paths, fail_commit=()):
+        self.engines = [sql.create_engine(get_dburl(p), connect_args={"check_same_thread": False})
+                        for p in paths]
+        self.dialect = self.engines[0].dialect
+        self.fail_commit = fail_commit
+        self.k = 0
+
+    def raw_connection(self):
+        k, self.k = self.k, self.k + 1
+        return TableConnection(self.engines[k].raw_connection(), k in self.fail_commit)
+
+def test_insert_tables():
+    from multiprocessing.pool import ThreadPool
+    from vcf2db import DBAPIWriter, PartialCommitError
+    metadata = sql.MetaData()
+    tables = [sql.Table("t%d" % k, metadata, sql.Column("id", sql.Integer(), primary_key=True),
+                        sql.Column("value", sql.Float())) for k in range(3)]
+    paths = ["tests/xx-table%d.db" % k for k in range(3)]
+    for path, t in zip(paths, tables):
+        rm(path)
+        atexit.register(rm, path)
+        t.create(sql.create_engine(get_dburl(path)))
+
+    def counts():
+        return [sql.create_engine(get_dburl(path)).execute(t.count()).scalar()
+                for path, t in zip(paths, tables)]
+
+    def clear():
+        for path, t in zip(paths, tables):
+            sql.create_engine(get_dburl(path)).execute(t.delete())
+
+    def rows(n, k):
+        return [dict(id=i, value=i * k / 2.0) for i in range(n)]
+
+    pool = ThreadPool(3)
+    # (a) each table is written on its own connection.
+    DBAPIWriter(TableEngines(paths)).insert_tables(
+            [(t, rows(10, k)) for k, t in enumerate(tables)], pool, group_size=3)
+    assert counts() == [10, 10, 10]
+    clear()
+
+    # (b) a duplicate id fails t1 after some groups were sent so all are rolled back.
+    batch = [(t, rows(10, k)) for k, t in enumerate(tables)]
+    bad = [(t, objs + objs[:1] if k == 1 else objs) for k, (t, objs) in enumerate(batch)]
+    try:
+        DBAPIWriter(TableEngines(paths)).insert_tables(bad, pool, group_size=3)
+        assert False, "expected an IntegrityError"
+    except sqlite3.IntegrityError:
+        pass
+    assert counts() == [0, 0, 0]
+    # so a retry writes each row once.
+    DBAPIWriter(TableEngines(paths)).insert_tables(batch, pool, group_size=3)
+    assert counts() == [10, 10, 10]
+    clear()
+
+    # (c) a failed commit after t0 was committed can't be retried.
+    try:
+        DBAPIWriter(TableEngines(paths, fail_commit=(1,))).insert_tables(batch, pool)
+        assert False, "expected a PartialCommitError"
+    except PartialCommitError as e:
+        assert "t1" in str(e) and "t0" in str(e), e
+    assert counts() == [10, 0, 0]
+    clear()
+
+    # but if the first commit fails, nothing was written.
+    try:
+        DBAPIWriter(TableEngines(paths, fail_commit=(0,))).insert_tables(batch, pool)
+        assert False, "expected an OperationalError"
+    except PartialCommitError:
+        assert False, "nothing was committed"
+    except sqlite3.OperationalError:
+        pass
+    assert counts() == [0, 0, 0]
+    pool.terminate()
+
+def test_schema_cache():
+    import json
+    import tempfile
+    import shutil
+    cache = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, cache)
+    qry = "select sql from sqlite_master where name in ('variants', 'variant_impacts') order by name"
+    qv = "select * from variants order by variant_id"
+
+    VCFDB(vcf, db, ped, schema_cache=cache)
+    assert len(os.listdir(cache)) == 1
+    eng = sql.create_engine(get_dburl(db))
+    schema, expected = list(eng.execute(qry)), list(eng.execute(qv))
+
+    VCFDB(vcf, db, ped, schema_cache=cache)
+    assert list(eng.execute(qry)) == schema
+    assert list(eng.execute(qv)) == expected
+
+    # the cached widths are used instead of sampling.
+    path = os.path.join(cache, os.listdir(cache)[0])
+    widths = json.load(open(path))
+    widths["variants"]["gene"] = 33
+    json.dump(widths, open(path, "w"))
+    VCFDB(vcf, db, ped, schema_cache=cache)
+    assert "gene VARCHAR(33)" in list(eng.execute(qry))[1][0]
+
+    # a cache that can't be written doesn't stop the load.
+    VCFDB(vcf, db, ped, schema_cache="/proc/vcf2db-cache")
+    assert list(eng.execute(qv)) == expected
+    assert len(list(eng.execute("select name from sqlite_master where type = 'index'"))) > 0
+
+def test_schema_sample():
+    try:
+        import pysam
+    except ImportError:
+        return
+    import re
+    import warnings
+    header = [l for l in open(vcf) if l[0] == "#"]
+    first = [l for l in open(vcf) if l[0] != "#"][0].split("\t")
+    records = ["\t".join(["chr10", str(1000 * (k + 1))] + first[2:]) for k in range(300)]
+    # a long ID in the last record is only seen if the sample is spread across the contigs.
+    late = "\t".join(["chr3", "150000000", "rs" + "1" * 20] + first[3:])
+    plain, indexed = "tests/xx-sample.vcf", "tests/xx-sample.vcf.gz"
+    with open(plain, "w") as fh:
+        fh.writelines(header + records + [late])
+    pysam.tabix_compress(plain, indexed, force=True)
+    pysam.tabix_index(indexed, preset="vcf", force=True)
+    for f in (plain, indexed, indexed + ".tbi"):
+        atexit.register(rm, f)
+
+    def width():
+        eng = sql.create_engine(get_dburl(db))
+        schema, = next(iter(eng.execute("select sql from sqlite_master where name = 'variants'")))
+        return int(re.search("vcf_id VARCHAR\((\d+)\)", schema).group(1))
+
+    VCFDB(plain, db, ped, schema_sample=300)
+    assert width() < 22
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter("always")
+        VCFDB(indexed, db, ped, schema_sample=300)
+        assert width() >= 22
+        VCFDB(indexed, db, ped, schema_sample=300, regions=["chr3"])
+        assert width() >= 22
+    assert not [x for x in w if "no intervals" in str(x.message)], [str(x.message) for x in w]
+
+def test_shards():
+    try:
+        import pysam
+    except ImportError:
+        return
+    import json
+    import sqlite3
+    from vcf2db import shard_groups, load_shards
+    header = [l for l in open(vcf) if l[0] == "#"]
+    first = [l for l in open(vcf) if l[0] != "#"][0].split("\t")
+
+    def indexed(name, contigs):
+        path = "tests/xx-%s.vcf" % name
+        with open(path, "w") as fh:
+            fh.writelines(header + ["\t".join([c, str(1000 * (k + 1))] + first[2:]) for c in contigs for k in range(2)])
+        pysam.tabix_compress(path, path + ".gz", force=True)
+        pysam.tabix_index(path + ".gz", preset="vcf", force=True)
+        for f in (path, path + ".gz", path + ".gz.tbi"):
+            atexit.register(rm, f)
+        return path + ".gz"
+
+    # contigs without records get no shard.
+    few = indexed("few", ["chr1", "chr2", "chrUn_gl000220"])
+    assert shard_groups(few) == [("chr1", ["chr1"]), ("chr2", ["chr2"]), ("other", ["chrUn_gl000220"])]
+    assert [c for _, g in shard_groups(few, 2) for c in g] == ["chr1", "chr2", "chrUn_gl000220"]
+    # more chromosomes than sqlite can attach are grouped.
+    contigs = ["chr%d" % k for k in range(1, 13)] + ["chrUn_gl000220"]
+    groups = shard_groups(indexed("many", contigs))
+    assert len(groups) == 10, groups
+    assert sorted(c for _, g in groups for c in g) == sorted(contigs)
+
+    VCFDB(few, db, ped)
+    eng = sql.create_engine(get_dburl(db))
+    expected = {t: [rounded(r) for r in eng.execute("select * from %s order by sample_id" % t)]
+                for t in ("sample_genotype_counts", "sample_qc")}
+    n, = next(iter(eng.execute("select count(*) from variants")))
+
+    manifest = load_shards(few, "tests/xx-shard.db", ped)
+    assert [x["n_variants"] for x in manifest["shards"]] == [2, 2, 2]
+    eng = sql.create_engine(get_dburl("tests/xx-shard.db"))
+    for t in expected:
+        assert [rounded(r) for r in eng.execute("select * from %s order by sample_id" % t)] == expected[t], t
+    assert json.load(open("tests/xx-shard.manifest.json")) == manifest
+
+    # the attach script is run from the directory with the databases.
+    cwd = os.getcwd()
+    os.chdir("tests")
+    try:
+        conn = sqlite3.connect(manifest["db"])
+        conn.executescript(open(manifest["attach"]).read())
+        ids = [r[0] for r in conn.execute("select variant_id from variants")]
+        assert len(ids) == len(set(ids)) == n, ids
+    finally:
+        os.chdir(cwd)
+
 def check_cap(metadata):
     tbl = metadata.tables["variants"]
     vs = [x[0] for x in sql.select([tbl.c.m_cap_pred]).execute()]
@@ -5,10 +5,18 @@ Take a VCF and create a gemini compatible database
 """
 from __future__ import print_function
 import sys
+import os
+import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 import itertools as it
+import tempfile
+import shutil
 import re
+import warnings
 import zlib
+import hashlib
 import snappy
 try:
     import cPickle as pickle
@@ -20,6 +28,7 @@ except NameError:
     basestring = str
 
 import time
+import resource
 from collections import defaultdict
 
 import numpy as np
@@ -89,6 +98,47 @@ def fix_sample_name(s, patt=re.compile('-|\s|\\\\')):
     if s in ('0', '-9'): return s
     return patt.sub("_", from_bytes(s))
 
+def parse_size(size):
+    """
+    >>> parse_size("2G")
+    2147483648
+    >>> parse_size("512m")
+    536870912
+    >>> parse_size("1000")
+    1000
+    """
+    size = str(size).strip().upper().rstrip("B")
+    for i, suffix in enumerate("KMGT", start=1):
+        if size.endswith(suffix):
+            return int(float(size[:-1]) * 1024**i)
+    return int(size)
+
+def current_rss():
+    """resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError):
+        # this is the peak, not the current usage. kilobytes on linux, bytes on OS X
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+
+def payload_bytes(d):
+    """
+    rough estimate of the memory held by a variant dict.
+    >>> payload_bytes({'gt_types': np.zeros(100, dtype=np.int8), 'CSQ': 'x' * 100}) > 200
+    True
+    """
+    n = 0
+    for v in d.values():
+        if isinstance(v, np.ndarray):
+            # object arrays (gt_bases) hold pointers to python strings.
+            n += v.nbytes if v.dtype != object else 64 * v.size
+        elif isinstance(v, basestring):
+            n += len(v)
+        n += 64 # key and dict entry overhead
+    return n
+
 def grouper(n, iterable):
     iterable = iter(iterable)
     piece = list(it.islice(iterable, n))
@@ -109,6 +159,13 @@ def profiled():
     # ps.print_callers()
     print(s.getvalue())
 
+def drop_table_or_view(engine, name):
+    insp = sql.inspect(engine)
+    if name in insp.get_view_names():
+        engine.execute("DROP VIEW %s" % name)
+    elif name in insp.get_table_names():
+        engine.execute("DROP TABLE %s" % name)
+
 def set_column_length(e, column, length, saved=None):
     if saved is None: saved = {}  # avoid mutable default argument
     table = column.table
@@ -161,16 +218,30 @@ def info_parse(line,
 
 from sqlalchemy.types import TypeDecorator
 
+def to_ascii(value):
+    """
+    >>> to_ascii(u'abc\\xe9d')
+    'abcd'
+    >>> to_ascii(3)
+    3
+    """
+    if isinstance(value, (unicode, str)):
+        try:
+            # fast path: most values are already ascii.
+            value.encode('ascii')
+            return value
+        except UnicodeError:
+            return str(codecs.ascii_decode(value.encode('utf8'), 'ignore')[0])
+            #return b(value).decode(ESCAPE, 'replace')
+    return value
+
 class String(TypeDecorator):
     """coerce Python unicode to string"""
 
     impl = sql.String
 
     def process_bind_param(self, value, dialect):
-        if isinstance(value, (unicode, str)):
-            return codecs.ascii_decode(value.encode('utf8'), 'ignore')[0]
-            #return b(value).decode(ESCAPE, 'replace')
-        return value
+        return to_ascii(value)
 
 class Unicode(TypeDecorator):
     """coerce Python unicode to string"""
@@ -195,6 +266,304 @@ def get_dburl(db_path):
         db_path = "sqlite:///" + db_path
     return db_path
 
+class PartialCommitError(Exception):
+    "some but maybe not all of the tables in DBAPIWriter.insert_tables were committed"
+
+class DBAPIWriter(object):
+    """
+    send rows directly to the DBAPI cursor's executemany.
+    The INSERT for each table is compiled once and the bind processors for
+    each column are looked up once so that we avoid the per-row parameter
+    handling that sqlalchemy does in engine.execute(stmt, list_of_dicts).
+    Rows are sent as tuples for positional paramstyles (sqlite, MySQLdb) and as
+    dicts for named paramstyles (psycopg2).
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.dialect = engine.dialect
+        self._compiled = {}
+        self._executemany = None
+        if self.dialect.driver == "psycopg2":
+            try:
+                from psycopg2.extras import execute_batch
+                self._executemany = lambda cursor, stmt, rows: execute_batch(cursor, stmt, rows, page_size=1000)
+            except ImportError:
+                pass
+
+    def _processor(self, col_type):
+        # our String decorator only does to_ascii so skip the TypeDecorator machinery.
+        if isinstance(col_type, String):
+            impl = col_type.impl.dialect_impl(self.dialect).bind_processor(self.dialect)
+            if impl is None:
+                return to_ascii
+            return lambda value: impl(to_ascii(value))
+        return col_type.dialect_impl(self.dialect).bind_processor(self.dialect)
+
+    def _prepare(self, compiled, table, prefix="", defaults=True):
+        """
+        return the statement string, a list of (param name, key, default, processor)
+        for each parameter, and whether the paramstyle is positional.
+        """
+        escaped = getattr(compiled, "escaped_bind_names", None) or {}
+        names = compiled.positiontup if compiled.positional else list(compiled.binds)
+        spec = []
+        for name in names:
+            key = compiled.binds[name].key[len(prefix):]
+            col = table.columns[key]
+            default = None
+            if defaults and col.default is not None and col.default.is_scalar:
+                default = col.default.arg
+            spec.append((escaped.get(name, name), key, default, self._processor(col.type)))
+        return (compiled.string, spec, compiled.positional)
+
+    def compile(self, table):
+        if table not in self._compiled:
+            compiled = table.insert().compile(dialect=self.dialect,
+                                              column_keys=[c.key for c in table.columns])
+            self._compiled[table] = self._prepare(compiled, table)
+        return self._compiled[table]
+
+    def compile_update(self, table, columns, key="variant_id"):
+        ckey = (table, key) + tuple(columns)
+        if ckey not in self._compiled:
+            # bindparams can't share the column names in an UPDATE.
+            stmt = table.update().where(table.c[key] == sql.bindparam("u_" + key)).values(
+                    dict((c, sql.bindparam("u_" + c)) for c in columns))
+            compiled = stmt.compile(dialect=self.dialect)
+            self._compiled[ckey] = self._prepare(compiled, table, prefix="u_", defaults=False)
+        return self._compiled[ckey]
+
+    def rows(self, prepared, objs):
+        stmt, spec, positional = prepared
+        if positional:
+            return stmt, [tuple([p(o.get(k, dflt)) if p is not None else o.get(k, dflt)
+                                 for _, k, dflt, p in spec]) for o in objs]
+        return stmt, [dict([(n, p(o.get(k, dflt)) if p is not None else o.get(k, dflt))
+                            for n, k, dflt, p in spec]) for o in objs]
+
+    def insert(self, table, objs):
+        self.execute(self.compile(table), objs)
+
+    def update(self, table, objs, columns, key="variant_id"):
+        """set `columns` from each dict in objs for the row matching objs[key]"""
+        self.execute(self.compile_update(table, columns, key), objs)
+
+    def execute(self, prepared, objs, conn=None):
+        """
+        executemany on a new connection and commit, or on conn which is
+        left for the caller to commit.
+        """
+        stmt, rows = self.rows(prepared, objs)
+        own = conn is None
+        if own:
+            conn = self.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            if self._executemany is not None:
+                self._executemany(cursor, stmt, rows)
+            else:
+                cursor.executemany(stmt, rows)
+            cursor.close()
+            if own:
+                conn.commit()
+        except:
+            if own:
+                conn.rollback()
+            raise
+        finally:
+            if own:
+                conn.close()
+
+    def insert_tables(self, tables, pool, group_size=5000):
+        """
+        insert the (table, objs) pairs concurrently, each on its own connection
+        using the threads in pool. If any insert fails, all are rolled back.
+        The connections are then committed one after another so a failure
+        there leaves the earlier tables committed and raises PartialCommitError.
+        """
+        prepared = [self.compile(table) for table, _ in tables]
+        conns = [self.engine.raw_connection() for _ in tables]
+
+        def run(k):
+            # see VCFDB.__insert for why these are grouped.
+            for group in grouper(group_size, tables[k][1]):
+                self.execute(prepared[k], list(group), conns[k])
+
+        try:
+            try:
+                pool.map(run, range(len(tables)))
+            except:
+                for conn in conns:
+                    conn.rollback()
+                raise
+            for k, conn in enumerate(conns):
+                try:
+                    conn.commit()
+                except Exception as e:
+                    for c in conns[k:]:
+                        c.rollback()
+                    if k == 0:
+                        raise
+                    raise PartialCommitError("committing %s failed after %s were committed: %s" %
+                                             (tables[k][0].name, ", ".join(t.name for t, _ in tables[:k]) or "none", e))
+        finally:
+            for conn in conns:
+                conn.close()
+
+class SampleQC(object):
+    """
+    per-sample QC aggregates accumulated from the genotype matrix of each
+    chunk. The counts and sums are stored along with the derived values so
+    that the table can be merged across shards.
+    """
+    depth_bins = (10, 20, 30)
+    counts = ("n_sites", "n_called", "n_het", "n_hom_alt", "n_ts", "n_tv",
+              "n_depth", "n_gq") + tuple("n_dp%d" % b for b in depth_bins)
+    sums = ("depth_sum", "gq_sum")
+    derived = ("call_rate", "mean_depth", "mean_gq", "het_hom_alt_ratio", "ts_tv") + \
+              tuple("call_rate_dp%d" % b for b in depth_bins)
+
+    def __init__(self, n_samples):
+        self.values = {k: np.zeros(n_samples, dtype=np.int64) for k in self.counts}
+        self.values.update({k: np.zeros(n_samples) for k in self.sums})
+
+    @classmethod
+    def columns(cls):
+        return [sql.Column("sample_id", sql.Integer(), primary_key=True)] + \
+               [sql.Column(k, sql.Integer()) for k in cls.counts] + \
+               [sql.Column(k, sql.Float()) for k in cls.sums + cls.derived]
+
+    def add(self, variants, gt_types, vcf):
+        "gt_types is the (variants x samples) matrix for the chunk"
+        vals = self.values
+        called = gt_types != vcf.UNKNOWN
+        het, hom_alt = gt_types == vcf.HET, gt_types == vcf.HOM_ALT
+        sub_type = np.array([v['sub_type'] for v in variants])
+
+        vals['n_sites'] += len(variants)
+        vals['n_called'] += called.sum(axis=0)
+        vals['n_het'] += het.sum(axis=0)
+        vals['n_hom_alt'] += hom_alt.sum(axis=0)
+        vals['n_ts'] += (het | hom_alt)[sub_type == 'ts'].sum(axis=0)
+        vals['n_tv'] += (het | hom_alt)[sub_type == 'tv'].sum(axis=0)
+
+        # these are missing if the column was skipped.
+        if variants[0].get('gt_depths') is not None:
+            depths = np.array([v['gt_depths'] for v in variants])
+            ok = called & (depths >= 0)
+            vals['n_depth'] += ok.sum(axis=0)
+            vals['depth_sum'] += np.where(ok, depths, 0).sum(axis=0)
+            for b in self.depth_bins:
+                vals['n_dp%d' % b] += (ok & (depths >= b)).sum(axis=0)
+        if variants[0].get('gt_quals') is not None:
+            quals = np.array([v['gt_quals'] for v in variants])
+            ok = called & (quals >= 0)
+            vals['n_gq'] += ok.sum(axis=0)
+            vals['gq_sum'] += np.where(ok, quals, 0).sum(axis=0, dtype=np.float64)
+
+    def merge(self, other):
+        "add the counts and sums from another SampleQC (e.g. from a worker process)"
+        for k in self.values:
+            self.values[k] += other.values[k]
+
+    def add_table(self, engine):
+        "add the counts and sums from an existing sample_qc table"
+        keys = self.counts + self.sums
+        rows = np.array(engine.execute("select %s from sample_qc order by sample_id" % ", ".join(keys)).fetchall())
+        for i, k in enumerate(keys):
+            self.values[k] += rows[:, i].astype(self.values[k].dtype)
+
+    def rows(self):
+        vals = self.values
+
+        def ratio(a, b):
+            return [float(x) / y if y else None for x, y in zip(vals[a], vals[b])]
+
+        derived = dict(call_rate=ratio('n_called', 'n_sites'),
+                       mean_depth=ratio('depth_sum', 'n_depth'),
+                       mean_gq=ratio('gq_sum', 'n_gq'),
+                       het_hom_alt_ratio=ratio('n_het', 'n_hom_alt'),
+                       ts_tv=ratio('n_ts', 'n_tv'))
+        for b in self.depth_bins:
+            derived['call_rate_dp%d' % b] = ratio('n_dp%d' % b, 'n_sites')
+
+        rows = []
+        for i in range(len(vals['n_sites'])):
+            # int() and float() as numpy types are stored as blobs by sqlite.
+            r = dict(sample_id=i + 1)
+            r.update((k, int(vals[k][i])) for k in self.counts)
+            r.update((k, float(vals[k][i])) for k in self.sums)
+            r.update((k, derived[k][i]) for k in self.derived)
+            rows.append(r)
+        return rows
+
+class GeneSummary(object):
+    """
+    per-gene counts of variants by their most severe impact on the gene, of
+    LoF variants and, for each sample, of variants where the sample carries
+    the alternate allele. These are from the impacts kept in variant_impacts.
+    """
+    severities = {'LOW': 1, 'MED': 2, 'HIGH': 3}
+
+    def __init__(self, n_samples):
+        self.n_samples = n_samples
+        # gene => [n_variants, n_low, n_med, n_high, n_lof, carrier counts]
+        self.genes = {}
+
+    def add(self, variants, variant_impacts, gt_types, vcf):
+        "gt_types is the (variants x samples) matrix for the chunk"
+        per_variant = {}
+        for imp in variant_impacts:
+            if not imp['gene']: continue
+            key = (imp['variant_id'], imp['gene'])
+            sev, lof = per_variant.get(key, (0, False))
+            per_variant[key] = (max(sev, self.severities.get(imp['impact_severity'], 0)),
+                                lof or bool(imp['is_lof']))
+        if len(per_variant) == 0: return
+
+        carriers = ((gt_types == vcf.HET) | (gt_types == vcf.HOM_ALT)).astype(np.int32)
+        rows = {v['variant_id']: i for i, v in enumerate(variants)}
+
+        for (variant_id, gene), (sev, lof) in per_variant.items():
+            g = self.genes.get(gene)
+            if g is None:
+                g = self.genes[gene] = [0, 0, 0, 0, 0, np.zeros(self.n_samples, dtype=np.int32)]
+            g[0] += 1
+            if sev > 0:
+                g[sev] += 1
+            g[4] += lof
+            g[5] += carriers[rows[variant_id]]
+
+    def merge(self, other):
+        "add the counts from another GeneSummary (e.g. from a worker process)"
+        for gene, g in other.genes.items():
+            mine = self.genes.get(gene)
+            if mine is None:
+                self.genes[gene] = g
+            else:
+                for k in range(len(g)):
+                    mine[k] += g[k]
+
+    def write(self, engine, metadata, blobber):
+        longest = max([len(g) for g in self.genes] or [1])
+        t = sql.Table("gene_summary", metadata,
+                      sql.Column("gene", sql.String(longest), primary_key=True),
+                      sql.Column("n_variants", sql.Integer()),
+                      sql.Column("n_low", sql.Integer()),
+                      sql.Column("n_med", sql.Integer()),
+                      sql.Column("n_high", sql.Integer()),
+                      sql.Column("n_lof", sql.Integer()),
+                      sql.Column("n_carriers", sql.Integer()),
+                      sql.Column("carrier_counts", sql.LargeBinary()))
+        t.drop(checkfirst=True)
+        t.create()
+        rows = [dict(gene=gene, n_variants=g[0], n_low=g[1], n_med=g[2], n_high=g[3], n_lof=int(g[4]),
+                     n_carriers=int((g[5] > 0).sum()), carrier_counts=blobber(g[5]))
+                for gene, g in sorted(self.genes.items())]
+        if len(rows) > 0:
+            engine.execute(t.insert(), rows)
+
 class VCFDB(object):
     gt_cols = ("gts", "gt_types", "gt_phases", "gt_depths", "gt_ref_depths",
                "gt_alt_depths", "gt_quals", "gt_alt_freqs")
@@ -203,36 +572,124 @@ class VCFDB(object):
     _black_list = []
 
     def __init__(self, vcf_path, db_path, ped_path=None, blobber=pack_blob,
-                 black_list=None, expand=None, impacts_extras=None, aok=False):
-        self.vcf_path = vcf_path
+                 black_list=None, expand=None, impacts_extras=None, aok=False,
+                 batch_size=10000, batch_bytes=512 * 1024**2, max_memory=None,
+                 update_annotations=None, schema_sample=10000, regions=None,
+                 variant_id_start=1, reader_threads=None, skip_gt_cols=None,
+                 blob_threads=1, dedup_blobs=None, genotype_bitmaps=False,
+                 impact_policy=None, gene_summary=False, vcf_processes=1,
+                 schema_cache=None, writer_threads=1, clustered=False, sparse_info=None):
+        # multiple VCFs with the same samples are loaded in order.
+        self.vcf_paths = vcf_paths(vcf_path)
+        self.vcf_path = self.vcf_paths[0]
+        self.vcf_processes = vcf_processes
         self.db_path = get_dburl(db_path)
         self.aok = aok or []
-        self.engine = sql.create_engine(self.db_path, poolclass=sql.pool.NullPool)
+        # variants, variant_impacts and the expanded tables are written
+        # concurrently on their own connections with writer_threads > 1.
+        self.writer_threads = writer_threads
+        if writer_threads > 1 and self.db_path.startswith("sqlite"):
+            sys.stderr.write("sqlite allows a single writer so writer_threads is ignored\n")
+            self.writer_threads = 1
+        if self.writer_threads > 1:
+            self.engine = sql.create_engine(self.db_path, pool_size=self.writer_threads + 1)
+        else:
+            self.engine = sql.create_engine(self.db_path, poolclass=sql.pool.NullPool)
+        self.writer_pool = ThreadPool(self.writer_threads) if self.writer_threads > 1 else None
+        self.writer = DBAPIWriter(self.engine)
         self.impacts_headers = {}
         self.metadata = sql.MetaData(bind=self.engine)
         self.expand = expand or []
         self.stringers = []
         self.af_cols = []  # track these to set to -1
+        self.info_ids = {}  # column name => INFO ID
         self.extra_columns = []
         self.impacts_extras = set(map(clean, impacts_extras or []))
+        # see reduce_impacts
+        self.impact_policy = impact_policy or {}
+        self.gene_summary = gene_summary
 
         self.blobber = blobber
+        # snappy and zlib release the GIL so the genotype blobs are packed in threads.
+        self.blob_threads = blob_threads
+        self.blob_pool = ThreadPool(blob_threads) if blob_threads > 1 else None
         self.ped_path = ped_path
+        # a chunk is flushed when it reaches either limit. the limits are
+        # adjusted after each flush if max_memory (bytes of RSS) is given.
+        self.batch_size = self._batch_size = batch_size
+        self.batch_bytes = self._batch_bytes = batch_bytes
+        self.max_memory = max_memory
+        self.schema_sample = schema_sample
+        # directory of column widths from earlier loads; see schema_cache_path.
+        self.schema_cache = schema_cache
+        # regions (which require an index) are used to load a single shard.
+        self.regions = regions
+        self.variant_id_start = variant_id_start
+        self.reader_threads = reader_threads
+        # these are not decoded from the VCF and are stored as NULL.
+        self.skip_gt_cols = set(skip_gt_cols or [])
+        if "gt_types" in self.skip_gt_cols or self.skip_gt_cols.intersection(self.expand):
+            raise Exception("gt_types and --expand'ed fields can not be skipped")
+        self.gt_cols = tuple(c for c in VCFDB.gt_cols if not c in self.skip_gt_cols)
+        # blobs for these columns are stored once in genotype_blobs and the
+        # variants table becomes a view over variants_data.
+        self.dedup_cols = [c for c in VCFDB.gt_cols if c in (dedup_blobs or [])]
+        self.blob_ids = {}
+        # sqlite only: variant_impacts is a WITHOUT ROWID table on (variant_id, ordinal)
+        # and the genotype blobs go in variant_genotypes so variants_data rows are small.
+        self.clustered = clustered
+        if clustered and not self.db_path.startswith("sqlite"):
+            sys.stderr.write("the clustered layout is only for sqlite and is ignored\n")
+            self.clustered = False
+        # INFO fields set in fewer than this fraction of the sampled variants
+        # are stored in variant_info_sparse rather than as columns.
+        self.sparse_info = sparse_info
+        self.sparse_fields, self.sparse_ids = {}, {}
+        self.variants_name = "variants_data" if self.dedup_cols or self.clustered or sparse_info is not None \
+                             else "variants"
+        self.genotype_bitmaps = genotype_bitmaps
         self.black_list = list(VCFDB._black_list) + list(VCFDB.effect_list) + (black_list or [])
 
-        self.vcf = cyvcf2.VCF(vcf_path)
-        # we use the cache to infer the lengths of string fields.
-        self.cache = it.islice(self.vcf, 10000)
+        if update_annotations:
+            # updates are written one table at a time so variant_impacts is created with its foreign key.
+            if self.writer_pool is not None:
+                self.writer_pool.terminate()
+                self.writer_pool = None
+            tables = sql.inspect(self.engine).get_table_names()
+            if "variant_info_sparse" in tables:
+                raise Exception("can't update the annotations of a database with sparse INFO fields")
+            if "variants_data" in tables:
+                self.variants_name = "variants_data"
+            self.clustered = "variant_genotypes" in tables
+            # only the INFO field is used so don't read (or decode) the samples.
+            self.vcf = self.open_vcf(samples=[], lazy=True)
+            self.create_columns()
+            self.update(match_by=update_annotations)
+            return
+
+        self.vcf = self.open_vcf()
+        for path in self.vcf_paths[1:]:
+            if cyvcf2.VCF(path).samples != self.vcf.samples:
+                raise Exception("%s does not have the same samples as %s" % (path, self.vcf_path))
         self.create_columns()
         self.samples = self.create_samples()
-        self.genotype_counts = [
-            np.zeros(len(self.vcf.samples), dtype=int),
-            np.zeros(len(self.vcf.samples), dtype=int),
-            np.zeros(len(self.vcf.samples), dtype=int),
-            np.zeros(len(self.vcf.samples), dtype=int)]
+        self.reset_counts()
         self.load()
         self.write_sample_genotype_counts()
+        self.engine.execute(self.sample_qc_table.insert(), self.sample_qc.rows())
+        if self.gene_stats is not None:
+            self.gene_stats.write(self.engine, self.metadata, self.blobber)
+        if self.writer_pool is not None:
+            self.add_foreign_keys()
         self.index()
+        self.write_schema_cache()
+
+    def open_vcf(self, path=None, **kwargs):
+        vcf = cyvcf2.VCF(path or self.vcf_path, **kwargs)
+        if self.reader_threads:
+            # htslib's thread pool for BGZF decompression.
+            vcf.set_threads(self.reader_threads)
+        return vcf
 
     def _set_variant_properties(self, v, d):
         d['type'] = v.var_type
@@ -244,24 +701,55 @@ class VCFDB(object):
         d['num_unknown'] = v.num_unknown
         d['aaf'] = v.aaf
 
+    def reset_counts(self):
+        "start the per-sample genotype counts, sample QC and gene summary that are accumulated over the chunks"
+        n = len(self.samples)
+        self.genotype_counts = [np.zeros(n, dtype=int) for _ in range(4)]
+        self.sample_qc = SampleQC(n)
+        self.gene_stats = GeneSummary(n) if self.gene_summary else None
+
+    def counts(self):
+        return self.genotype_counts, self.sample_qc, self.gene_stats
+
+    def merge_counts(self, counts):
+        "add the counts from a worker process (see counts)"
+        genotype_counts, sample_qc, gene_stats = counts
+        for mine, theirs in zip(self.genotype_counts, genotype_counts):
+            mine += theirs
+        self.sample_qc.merge(sample_qc)
+        if self.gene_stats is not None:
+            self.gene_stats.merge(gene_stats)
+
     def write_sample_genotype_counts(self):
         t = self.genotype_counts_table
         self.engine.execute(t.insert(), [
-            dict(sample=self.samples[i],
-                 num_hom_ref=self.genotype_counts[0][i],
-                 num_het=self.genotype_counts[1][i],
-                 num_hom_alt=self.genotype_counts[2][i],
-                 num_unknown=self.genotype_counts[3][i])
+            # int() as numpy ints are stored as blobs by sqlite.
+            dict(sample_id=i + 1,
+                 num_hom_ref=int(self.genotype_counts[0][i]),
+                 num_het=int(self.genotype_counts[1][i]),
+                 num_hom_alt=int(self.genotype_counts[2][i]),
+                 num_unknown=int(self.genotype_counts[3][i]))
             for i in range(len(self.samples))])
 
-    def _load(self, iterable, create, start):
+    def _load(self, iterable, start):
 
-        self.bool_cols = [v.name for v in self.variants_columns if str(v.type) == "BOOLEAN"]
+        self.bool_cols = [v.name for v in self.variants_columns if str(v.type) == "BOOLEAN" and
+                          not v.name in self.sparse_fields]
+        for variants, expanded, keys, i in self.variant_chunks(iterable, start):
+            self.insert(variants, expanded, keys, i)
 
+    def variant_chunks(self, iterable, start):
+        """
+        yield (variants, expanded, keys, i) for chunks of the records in iterable
+        where i is the variant_id of the last variant in the chunk.
+        """
         variants = []
         expanded = {k: [] for k in self.expand}
         keys = set()
         i = None
+        nbytes = 0
+        # the expanded dicts hold a python object for each sample.
+        expanded_bytes = 96 * len(self.expand) * len(self.samples)
         must_idx = not np.all(self.sample_idxs == range(len(self.sample_idxs)))
 
         for i, v in enumerate(iterable, start=start):
@@ -277,12 +765,6 @@ class VCFDB(object):
                     # view of the C copy
                     d[c] = np.array(arr)
 
-            gt_types = d['gt_types']
-            self.genotype_counts[0][gt_types == self.vcf.HOM_REF] += 1
-            self.genotype_counts[1][gt_types == self.vcf.HET] += 1
-            self.genotype_counts[2][gt_types == self.vcf.HOM_ALT] += 1
-            self.genotype_counts[3][gt_types == self.vcf.UNKNOWN] += 1
-
             d['chrom'], d['start'], d['end'] = v.CHROM, v.start, v.end
             d['ref'], d['alt'] = v.REF, ",".join(v.ALT)
 
@@ -300,25 +782,417 @@ class VCFDB(object):
             keys.update(d.keys())
 
             variants.append(d)
+            nbytes += payload_bytes(d) + expanded_bytes
             # http://docs.sqlalchemy.org/en/latest/faq/performance.html
-            if not create and (i % 10000) == 0:
-                self.insert(variants, expanded, keys, i)
+            if len(variants) >= self.batch_size or nbytes >= self.batch_bytes:
+                yield variants, expanded, keys, i
                 variants = variants[:0]
-                for k in expanded:
-                    expanded[k] = expanded[k][:0]
+                expanded = {k: [] for k in self.expand}
+                nbytes = 0
+                self.adapt_batch_size()
 
         if len(variants) != 0:
-            self.insert(variants, expanded, keys, i, create=create)
+            yield variants, expanded, keys, i
 
-        return i
+    def adapt_batch_size(self):
+        """
+        shrink the batch limits when the RSS is over max_memory and grow them
+        back toward the requested values when there is room again.
+        """
+        if not self.max_memory:
+            return
+        rss = current_rss()
+        if rss > self.max_memory and self.batch_size > 100:
+            self.batch_size = max(100, self.batch_size // 2)
+            self.batch_bytes = max(1024**2, self.batch_bytes // 2)
+            sys.stderr.write("RSS of %dMB is over --max-memory. reducing batch size to %d\n" %
+                             (rss // 1024**2, self.batch_size))
+        elif rss < 0.6 * self.max_memory and self.batch_size < self._batch_size:
+            self.batch_size = min(self._batch_size, int(1.5 * self.batch_size))
+            self.batch_bytes = min(self._batch_bytes, int(1.5 * self.batch_bytes))
 
     def load(self):
         self.t0 = self.t = time.time()
+        self._reported = 0
 
-        i = self._load(self.cache, create=True, start=1)
-        self.cache = []
+        self.sample_schema()
         #with profiled():
-        self._load(self.vcf, create=False, start=i+1)
+        if len(self.vcf_paths) > 1 and self.vcf_processes > 1:
+            self.load_parallel()
+        else:
+            self._load(self.records(), start=self.variant_id_start)
+        for pool in (self.blob_pool, self.writer_pool):
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def load_parallel(self):
+        """
+        annotate each VCF in its own (forked) process. The workers also pack the
+        genotype blobs and count the genotypes (see finish_chunk) and the
+        finished chunks are spooled to disk and written here in the order of the
+        files so that the variant_ids follow that order.
+        """
+        global _spool_vcfdb
+        _spool_vcfdb = self
+        spool_dir = tempfile.mkdtemp(prefix="vcf2db-")
+        # the workers get self by forking (see _spool_vcf), which isn't the default everywhere.
+        ctx = multiprocessing.get_context("fork") if hasattr(multiprocessing, "get_context") else multiprocessing
+        pool = ctx.Pool(min(self.vcf_processes, len(self.vcf_paths)), initializer=_init_spool_worker)
+        offset = self.variant_id_start - 1
+        try:
+            args = [(path, os.path.join(spool_dir, "%d.pkl" % k)) for k, path in enumerate(self.vcf_paths)]
+            for spool, n_variants, n_chunks, counts in pool.imap(_spool_vcf, args):
+                with open(spool, "rb") as fh:
+                    for _ in range(n_chunks):
+                        variants, variant_impacts, expanded, bitmaps, te = pickle.load(fh)
+                        for d in it.chain(variants, variant_impacts, *expanded.values()):
+                            d['variant_id'] += offset
+                        for b in bitmaps:
+                            b['first_variant_id'] += offset
+                        if self.blobber is snappy_pack_blob:
+                            for v in variants:
+                                for c in self.gt_cols:
+                                    if isinstance(v[c], bytes):
+                                        v[c] = buffer(v[c])
+                        self.write_chunk(variants, variant_impacts, expanded, variants[-1]['variant_id'], te,
+                                         bitmaps=bitmaps)
+                os.unlink(spool)
+                self.merge_counts(counts)
+                offset += n_variants
+        finally:
+            pool.terminate()
+            pool.join()
+            shutil.rmtree(spool_dir, ignore_errors=True)
+            _spool_vcfdb = None
+
+    def records(self, paths=None, **kwargs):
+        """the records from each of the VCFs (or paths) in order, restricted to self.regions"""
+        def iterables():
+            for path in paths or self.vcf_paths:
+                # a forked worker (with paths) must not share our reader.
+                if paths is None and path == self.vcf_path and not kwargs:
+                    vcf = self.vcf
+                else:
+                    vcf = self.open_vcf(path, **kwargs)
+                if self.regions is None:
+                    yield vcf
+                else:
+                    for r in self.regions:
+                        yield vcf(r)
+        return it.chain.from_iterable(iterables())
+
+    def schema_records(self, path, n, per_region=100):
+        """
+        yield up to n records, read without samples, to infer the string column widths.
+        If the VCF is indexed, the records are taken from n // per_region evenly
+        spaced windows across self.regions (or the contigs with records) so that
+        long strings later in the file are seen, otherwise the first n records
+        are used.
+        """
+        vcf = self.open_vcf(path, samples=[], lazy=True)
+        lengths = {}
+        # check for the index ourselves as htslib complains loudly when it's missing.
+        if any(os.path.exists(path + ext) for ext in (".tbi", ".csi")):
+            try:
+                lengths = {c: l for c, l in zip(vcf.seqnames, vcf.seqlens) if l > 0}
+            except Exception:
+                # no contig lengths in the header.
+                pass
+        spans = None
+        if len(lengths) > 0 and n >= 2 * per_region:
+            if self.regions is not None:
+                spans = [region_span(r, lengths) for r in self.regions]
+            else:
+                spans = [(c, 0, lengths[c]) for c in contigs_with_records(vcf) if c in lengths]
+        if not spans or None in spans:
+            records = vcf if self.regions is None else \
+                      it.chain.from_iterable(region_records(vcf, r) for r in self.regions)
+            for v in it.islice(records, n):
+                yield v
+            return
+
+        # n // per_region evenly spaced windows over the spans laid end to end so
+        # that many small contigs don't each get a window.
+        offsets = np.cumsum([0] + [end - start for _, start, end in spans])
+        n_regions = n // per_region
+        width = offsets[-1] / float(n_regions)
+        n_seen = 0
+        for p in np.arange(n_regions) * width:
+            k = np.searchsorted(offsets, p, side="right") - 1
+            chrom, start, end = spans[k]
+            s = start + int(p - offsets[k])
+            e = min(end, int(s + width))
+            if e <= s: continue
+            for v in it.islice(region_records(vcf, "%s:%d-%d" % (chrom, s + 1, e)), min(per_region, n - n_seen)):
+                yield v
+                n_seen += 1
+            if n_seen >= n:
+                return
+
+    def sample_schema(self):
+        """
+        size the string columns from a sample of INFO and effect strings (or
+        from the schema cache) and create the tables. This happens before any
+        genotypes are read.
+        """
+        t0 = time.time()
+        self.bool_cols = [v.name for v in self.variants_columns if str(v.type) == "BOOLEAN"]
+        if self.read_schema_cache():
+            sys.stderr.write("using the cached schema in %s\n" % self.schema_cache_path)
+            self._create_tables()
+            return
+
+        variants, keys = [], set()
+        filled = defaultdict(int)
+        n = max(1, self.schema_sample // len(self.vcf_paths))
+        for v in it.chain.from_iterable(self.schema_records(p, n) for p in self.vcf_paths):
+            d = dict(v.INFO)
+            d['chrom'], d['start'], d['end'] = v.CHROM, v.start, v.end
+            d['ref'], d['alt'] = v.REF, ",".join(v.ALT)
+            d['qual'], d['filter'], d['vcf_id'] = v.QUAL, v.FILTER, v.ID
+            d['type'], d['sub_type'] = v.var_type, v.var_subtype
+            d['variant_id'] = len(variants) + 1
+            for k in d:
+                filled[k] += 1
+            keys.update(d.keys())
+            variants.append(d)
+
+        if self.sparse_info is not None and len(variants) > 0:
+            # gene_info copies the impacts_extras to variant_impacts so those stay columns.
+            self.set_sparse_fields([cid for cid, info_id in self.info_ids.items() if
+                                    filled[info_id] < self.sparse_info * len(variants) and
+                                    not cid in self.impacts_extras])
+        variants, variant_impacts = self.annotate(variants, keys)
+        self.create(variants, variant_impacts)
+        sys.stderr.write("sampled %d variants for the schema in %.1f seconds\n" % (len(variants), time.time() - t0))
+
+    def set_sparse_fields(self, names):
+        "store the INFO fields in names (column names) in variant_info_sparse"
+        self.sparse_fields = {name: k + 1 for k, name in enumerate(sorted(names))}
+        self.sparse_ids = {self.info_ids[name]: name for name in names}
+        # the view fills in the -1 and False defaults.
+        self.af_cols = [c for c in self.af_cols if not c in self.sparse_fields]
+        self.bool_cols = [c for c in self.bool_cols if not c in self.sparse_fields]
+        if len(names) > 0:
+            sys.stderr.write("storing %d sparse INFO fields in variant_info_sparse\n" % len(names))
+
+    @property
+    def schema_cache_path(self):
+        """
+        the cache file for VCFs with the same INFO header lines (including the
+        CSQ/ANN layout) loaded with the same options.
+        """
+        infos = [l for l in from_bytes(self.raw_header).split("\n") if l.startswith("##INFO")]
+        key = json.dumps(dict(infos=infos, black_list=sorted(self.black_list), aok=sorted(self.aok),
+                              impacts_extras=sorted(self.impacts_extras), impact_policy=self.impact_policy,
+                              sparse_info=self.sparse_info, version=__version__), sort_keys=True)
+        return os.path.join(self.schema_cache, hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+    def column_widths(self):
+        "lengths of the String columns, None for those that became TEXT"
+        widths = {}
+        for name, cols in (("variants", self.variants_columns), ("variant_impacts", self.variant_impacts_columns)):
+            widths[name] = {c.name: getattr(c.type, "length", None) if c.type.__class__.__name__ == "String" else None
+                            for c in cols if c.type.__class__.__name__ in ("String", "TEXT")}
+        return widths
+
+    def read_schema_cache(self):
+        "set the column widths from the cache and return True if there is one for this VCF"
+        if not self.schema_cache or not os.path.exists(self.schema_cache_path):
+            return False
+        with open(self.schema_cache_path) as fh:
+            widths = json.load(fh)
+        for name, cols in (("variants", self.variants_columns), ("variant_impacts", self.variant_impacts_columns)):
+            for c in cols:
+                if c.type.__class__.__name__ != "String" or not c.name in widths[name]: continue
+                if widths[name][c.name] is None:
+                    c.type = sql.TEXT()
+                else:
+                    c.type.length = widths[name][c.name]
+        if self.sparse_info is not None:
+            self.set_sparse_fields(widths.get("sparse", []))
+        return True
+
+    def write_schema_cache(self):
+        """
+        save the column widths, including any that grew during the load.
+        The cache is only an optimization so a failure to write it is a warning.
+        """
+        if not self.schema_cache:
+            return
+        widths = self.column_widths()
+        widths["sparse"] = sorted(self.sparse_fields)
+        # rename so that concurrent loads (e.g. shards) never see a partial file.
+        tmp = "%s.%d" % (self.schema_cache_path, os.getpid())
+        try:
+            if not os.path.isdir(self.schema_cache):
+                os.makedirs(self.schema_cache)
+            with open(tmp, "w") as fh:
+                json.dump(widths, fh, indent=1, sort_keys=True)
+            os.rename(tmp, self.schema_cache_path)
+        except (IOError, OSError) as e:
+            sys.stderr.write("WARNING: couldn't write the schema cache to %s: %s\n" % (self.schema_cache, e))
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+    def update(self, match_by="position"):
+        """
+        update the INFO-derived and gene columns in an existing database and
+        rebuild variant_impacts, e.g. after re-running VEP or vcfanno.
+        The genotype columns are left as they are.
+        match_by is "position" to match variants on (chrom, start, ref, alt) or
+        "order" if the VCF has the same variants in the same order as the one
+        that was loaded. With "order", we stop at the first variant that differs
+        from the database. A gene_summary table is dropped rather than left stale.
+        """
+        self.t0 = time.time()
+        self.sample_idxs = np.array([], dtype=int)
+        self.metadata.reflect(only=[self.variants_name])
+        self.variants = self.metadata.tables[self.variants_name]
+        self.bool_cols = [v.name for v in self.variants_columns if str(v.type) == "BOOLEAN"]
+
+        fixed = set(c.name for c in self.variants_default_columns() +
+                    self.variants_calculated_columns() + self.variants_genotype_columns())
+        update_cols, added = [], []
+        for col in self.variants_columns:
+            if col.name in fixed: continue
+            if not col.name in self.variants.columns:
+                self.add_column(self.variants, col)
+                added.append(col)
+            update_cols.append(col.name)
+        if added and self.variants_name != "variants":
+            self.recreate_variants_view(added)
+        string_cols = {c.name: c for c in self.variants.columns if c.name in update_cols and
+                       isinstance(c.type, sql.String) and c.type.length}
+
+        # the annotation fields may have changed so variant_impacts is re-created.
+        self.variant_impacts = self.variant_impacts_table()
+        self.variant_impacts.drop(checkfirst=True)
+        self.variant_impacts.create()
+        # gene_summary is computed from variant_impacts and the genotypes, which we don't read here.
+        if "gene_summary" in sql.inspect(self.engine).get_table_names():
+            drop_table_or_view(self.engine, "gene_summary")
+            sys.stderr.write("WARNING: dropped the gene_summary table as it would be out of date. "
+                             "reload with --gene-summary to rebuild it\n")
+        # our reader has no samples so get the full header (with the #CHROM line) separately.
+        self.create_vcf_header_table(self.raw_header)
+
+        if match_by == "order":
+            stored = self.stored_keys()
+        elif match_by == "position":
+            # the lookup holds a single chromosome at a time.
+            lookup, lookup_chrom = {}, None
+        else:
+            raise Exception("unknown match_by: %s" % match_by)
+
+        i, n_missing, n_matched = 0, 0, 0
+        for chunk in grouper(self.batch_size, self.records(samples=[], lazy=True)):
+            variants, keys = [], set()
+            for v in chunk:
+                i += 1
+                d = dict(v.INFO)
+                d['chrom'], d['start'], d['end'] = v.CHROM, v.start, v.end
+                d['ref'], d['alt'] = v.REF, ",".join(v.ALT)
+                if match_by == "order":
+                    row = next(stored, None)
+                    if row is None or row[1:] != (d['chrom'], d['start'], d['ref'], d['alt']):
+                        raise Exception("variant %d in the VCF (%s:%d %s>%s) does not match the database (%s). "
+                                        "the database is partially updated; re-run with match_by='position'" %
+                                        (i, d['chrom'], d['start'] + 1, d['ref'], d['alt'],
+                                         "no more variants" if row is None else "variant_id %d at %s:%d %s>%s" %
+                                         (row[0], row[1], row[2] + 1, row[3], row[4])))
+                    d['variant_id'] = row[0]
+                else:
+                    if d['chrom'] != lookup_chrom:
+                        lookup, lookup_chrom = self.position_lookup(d['chrom']), d['chrom']
+                    # popped so that the variants left over were not in the VCF.
+                    d['variant_id'] = lookup.pop((d['start'], d['ref'], d['alt']), None)
+                    if d['variant_id'] is None:
+                        n_missing += 1
+                        continue
+                    n_matched += 1
+                keys.update(d.keys())
+                variants.append(d)
+
+            variants, variant_impacts = self.annotate(variants, keys)
+            if self.engine.dialect.name != "sqlite":
+                for name, clen in self.check_column_lengths(variants, string_cols).items():
+                    set_column_length(self.engine, self.variants.columns[name], clen)
+                for name, clen in self.check_column_lengths(variant_impacts, {c.name: c for c in
+                        self.variant_impacts_columns if c.type.__class__.__name__ == "String"}).items():
+                    set_column_length(self.engine, self.variant_impacts.columns[name], clen)
+
+            if len(variants) > 0:
+                self.writer.update(self.variants, variants, update_cols)
+            if len(variant_impacts) > 0:
+                self.__insert(variant_impacts, self.variant_impacts)
+            sys.stderr.write("%d variants updated\t%.2f variants/second\n" % (i - n_missing, i / float(time.time() - self.t0)))
+
+        if match_by == "order":
+            row = next(stored, None)
+            if row is not None:
+                raise Exception("the VCF ended before variant_id %d (%s:%d %s>%s) in the database. "
+                                "the database is partially updated; re-run with match_by='position'" %
+                                (row[0], row[1], row[2] + 1, row[3], row[4]))
+        else:
+            n_stale = self.engine.execute(sql.select([sql.func.count()]).select_from(self.variants)).scalar() - n_matched
+            if n_stale > 0:
+                sys.stderr.write("WARNING: %d variants in the database were not in the VCF. they keep their old "
+                                 "annotations but have no rows in variant_impacts\n" % n_stale)
+        if n_missing > 0:
+            sys.stderr.write("WARNING: %d variants in the VCF were not found in the database\n" % n_missing)
+
+    def recreate_variants_view(self, added):
+        "recreate the variants view of an existing database to include the columns added to variants_data"
+        insp = sql.inspect(self.engine)
+        stored = set(c["name"] for c in insp.get_columns(self.variants_name))
+        if self.clustered:
+            self.genotypes_table = sql.Table("variant_genotypes", self.metadata, autoload=True)
+            stored.update(self.genotypes_table.c.keys())
+        self.dedup_cols = [c for c in VCFDB.gt_cols if c + "_blob_id" in stored]
+        if self.dedup_cols:
+            self.blobs_table = sql.Table("genotype_blobs", self.metadata, autoload=True)
+        columns = [sql.Column(c["name"], c["type"]) for c in insp.get_columns("variants")]
+        drop_table_or_view(self.engine, "variants")
+        self.create_variants_view(columns + added)
+
+    def stored_keys(self):
+        """
+        yield (variant_id, chrom, start, ref, alt) for the variants in the
+        database in variant_id order. These are read a batch at a time so that
+        no cursor is left open while we write.
+        """
+        t = self.variants
+        q = sql.select([t.c.variant_id, t.c.chrom, t.c.start, t.c.ref, t.c.alt]).order_by(t.c.variant_id)
+        last = None
+        while True:
+            rows = self.engine.execute((q if last is None else q.where(t.c.variant_id > last))
+                                       .limit(self.batch_size)).fetchall()
+            if len(rows) == 0:
+                return
+            for r in rows:
+                yield tuple(r)
+            last = rows[-1][0]
+
+    def position_lookup(self, chrom):
+        "(start, ref, alt) => variant_id for the variants on chrom"
+        t = self.variants
+        return {(start, ref, alt): vid for vid, start, ref, alt in
+                self.engine.execute(sql.select([t.c.variant_id, t.c.start, t.c.ref, t.c.alt])
+                                    .where(t.c.chrom == chrom))}
+
+    def add_column(self, table, col):
+        """add a column (e.g. for a new INFO field) to an existing table"""
+        col = col.copy()
+        # existing rows won't have a value.
+        col.nullable = True
+        table.append_column(col)
+        ddl = sql.schema.CreateColumn(col).compile(dialect=self.engine.dialect)
+        sys.stderr.write("adding column '%s' to %s\n" % (col.name, table.name))
+        self.engine.execute("ALTER TABLE %s ADD COLUMN %s" % (table.name, ddl))
 
     def check_column_lengths(self, dicts, cols):
         change_cols = defaultdict(int)
@@ -329,14 +1203,24 @@ class VCFDB(object):
                     change_cols[c.name] = max(change_cols[c.name], len(d.get(name)))
         return dict(change_cols)
 
-    def insert(self, variants, expanded, keys, i, create=False):
+    def annotate(self, variants, keys):
+        """
+        set the bin and run gene_info on each variant dict and fill the af and flag defaults.
+        returns the variant dicts and the variant_impacts dicts.
+        """
         ivariants, variant_impacts = [], []
-        te = time.time()
         has_samples = not self.sample_idxs is None
+        bins = ucsc_bin([v['start'] for v in variants], [v['end'] for v in variants])
+        for v, b in zip(variants, bins.tolist()):
+            v['bin'] = b
+        if self.sparse_ids:
+            self.extract_sparse(variants)
+            # so gene_info doesn't pad every variant with these.
+            keys = keys.difference(self.sparse_ids)
 
         for variant, impacts in map(gene_info, ((v,
-                     self.impacts_headers, self.blobber, self.gt_cols, keys,
-                     has_samples, self.stringers, self.extra_columns, self.impacts_extras) for
+                     self.impacts_headers, keys, has_samples, self.stringers, self.extra_columns, self.impacts_extras,
+                     self.impact_policy) for
                      v in variants)
                      ):
             # set afs columns to -1 by default.
@@ -351,17 +1235,121 @@ class VCFDB(object):
             for b in self.bool_cols:
                 if variant.get(b) is None:
                     variant[b] = False
+            if self.clustered:
+                for k, impact in enumerate(impacts):
+                    impact['ordinal'] = k
             variant_impacts.extend(impacts)
             ivariants.append(variant)
-        te = time.time() - te
+        return ivariants, variant_impacts
 
-        variants = ivariants
-        vlengths = vilengths = {}
+    def genotype_bitmap_rows(self, variants, gt_types):
+        """
+        rows for sample_genotype_bitmaps with zlib'ed bitsets over the variants in
+        this chunk for each sample with a bit set where the sample is het, hom-alt
+        or called. see genotype_bitmap_query.
+        """
+        first = variants[0]['variant_id']
+        assert variants[-1]['variant_id'] - first + 1 == len(variants)
+        rows = []
+        for kind, mask in (("het", gt_types == self.vcf.HET),
+                           ("hom_alt", gt_types == self.vcf.HOM_ALT),
+                           ("called", gt_types != self.vcf.UNKNOWN)):
+            # one row of packed bits per sample.
+            bits = np.packbits(mask, axis=0).T
+            for i in range(bits.shape[0]):
+                rows.append(dict(sample_id=i + 1, kind=kind, first_variant_id=first,
+                                 n_variants=len(variants), bits=zlib.compress(bits[i].tobytes(), 1)))
+        return rows
+
+    def pack_blobs(self, variants):
+        """
+        replace the genotype arrays in each variant with the packed blob.
+        this uses the same blobber for each array so the output is unchanged
+        by the number of threads.
+        """
+        arrs = [v[c] for v in variants for c in self.gt_cols]
+        if self.blob_pool is None:
+            packed = list(map(self.blobber, arrs))
+        else:
+            packed = self.blob_pool.map(self.blobber, arrs,
+                                        chunksize=1 + len(arrs) // (4 * self.blob_threads))
+        packed = iter(packed)
+        for v in variants:
+            for c in self.gt_cols:
+                v[c] = next(packed)
+
+    def dedup(self, variants):
+        """
+        replace the packed blobs in dedup_cols with the id of the blob in
+        genotype_blobs, inserting any blobs that we haven't seen before.
+        """
+        blobs = []
+        for v in variants:
+            for c in self.dedup_cols:
+                blob = v.pop(c, None)
+                if blob is None: continue
+                key = hashlib.md5(blob).digest()
+                bid = self.blob_ids.get(key)
+                if bid is None:
+                    bid = self.blob_ids[key] = len(self.blob_ids) + 1
+                    blobs.append({"blob_id": bid, "blob": blob})
+                v[c + "_blob_id"] = bid
+        if len(blobs) > 0:
+            self.__insert(blobs, self.blobs_table)
+
+    def insert(self, variants, expanded, keys, i):
+        te = time.time()
+        variants, variant_impacts = self.annotate(variants, keys)
+        self.write_chunk(variants, variant_impacts, expanded, i, time.time() - te)
+
+    def extract_sparse(self, variants):
+        """
+        move the values of the sparse INFO fields from each variant to a list of
+        (field_id, value) in variant['sparse_info']. The rows for variant_info_sparse
+        are made in write_chunk once the variant_ids are final (see load_parallel).
+        """
+        for v in variants:
+            values = []
+            for info_id, name in self.sparse_ids.items():
+                value = sparse_value(v.pop(info_id, None), info_id in self.stringers, af_like(name))
+                if value is not None:
+                    values.append((self.sparse_fields[name], value))
+            v['sparse_info'] = values
+
+    def finish_chunk(self, variants, variant_impacts):
+        """
+        add the annotated chunk to the genotype counts, sample QC and gene summary,
+        pack the genotype blobs and return the rows for sample_genotype_bitmaps.
+        This doesn't touch the database so that it can run in the workers of
+        load_parallel.
+        """
+        gt_types = np.array([v['gt_types'] for v in variants])
+        for k, gt_type in enumerate((self.vcf.HOM_REF, self.vcf.HET, self.vcf.HOM_ALT, self.vcf.UNKNOWN)):
+            self.genotype_counts[k] += (gt_types == gt_type).sum(axis=0)
+        self.sample_qc.add(variants, gt_types, self.vcf)
+        if self.gene_stats is not None:
+            self.gene_stats.add(variants, variant_impacts, gt_types, self.vcf)
+        bitmaps = self.genotype_bitmap_rows(variants, gt_types) if self.genotype_bitmaps else []
+        self.pack_blobs(variants)
+        return bitmaps
+
+    def write_chunk(self, variants, variant_impacts, expanded, i, te, bitmaps=None):
+        """
+        write the annotated variants; te is the time taken by annotate. bitmaps
+        is given if the chunk was already finished (see finish_chunk).
+        """
+        sparse_rows = [dict(variant_id=v['variant_id'], field_id=field_id, value=value)
+                       for v in variants for field_id, value in v.pop('sparse_info', ())] if self.sparse_ids else []
+        if bitmaps is None:
+            bitmaps = self.finish_chunk(variants, variant_impacts)
+        if len(bitmaps) > 0:
+            self.__insert(bitmaps, self.bitmaps_table)
+        if self.dedup_cols:
+            self.dedup(variants)
 
-        if create:
-            self.create(variants, variant_impacts)
+        vlengths = vilengths = {}
 
-        elif self.engine.dialect.name != "sqlite":
+        if self.engine.dialect.name != "sqlite":
             vlengths = self.check_column_lengths(variants, {c.name: c for c in self.variants_columns if
                 c.type.__class__.__name__ == "String"})
 
@@ -369,26 +1357,34 @@ class VCFDB(object):
                 self.variant_impacts_columns if c.type.__class__.__name__ ==
                 "String"})
 
-        self._insert(vlengths, variants,
-                     vilengths, variant_impacts)
-
-        ex = time.time()
-        for k in expanded:
-            self.__insert(expanded[k], self.metadata.tables["sample_" + k].insert())
-        ex = time.time() - ex
-        vps = i / float(time.time() - self.t0)
+        if self.writer_pool is not None:
+            ex = 0
+            self.insert_concurrently(vlengths, variants, vilengths, variant_impacts, expanded, sparse_rows)
+        else:
+            self._insert(vlengths, variants,
+                         vilengths, variant_impacts)
+            if len(sparse_rows) > 0:
+                self.__insert(sparse_rows, self.sparse_table)
+
+            ex = time.time()
+            for k in expanded:
+                self.__insert(expanded[k], self.metadata.tables["sample_" + k])
+            ex = time.time() - ex
+        n = i - self.variant_id_start + 1
+        vps = n / float(time.time() - self.t0)
 
         # reduce number of error messages after 100K
-        if i <= 100000 or i % 200000 == 0:
+        if n <= 100000 or n // 200000 > self._reported // 200000:
 
             fmt = "%d variant_impacts:%d\teffects time: %.1f\tchunk time:%.1f\t%.2f variants/second"
             if self.expand:
                 fmt += "\texpanded columns:%.2f\n"
-                sys.stderr.write(fmt % (i, len(variant_impacts), te, time.time() - self.t, vps, ex))
+                sys.stderr.write(fmt % (n, len(variant_impacts), te, time.time() - self.t, vps, ex))
             else:
                 fmt += "\n"
-                sys.stderr.write(fmt % (i, len(variant_impacts), te, time.time() - self.t, vps))
+                sys.stderr.write(fmt % (n, len(variant_impacts), te, time.time() - self.t, vps))
 
+        self._reported = n
         self.t = time.time()
 
 
@@ -398,17 +1394,49 @@ class VCFDB(object):
             col = self.variants.columns[name]
             set_column_length(self.engine, col, clen)
 
-        self.__insert(v_objs, self.metadata.tables['variants'].insert())
+        self.__insert(v_objs, self.variants)
+        if self.clustered:
+            self.__insert(v_objs, self.genotypes_table)
 
         for name, clen in vilengths.items():
             col = self.variant_impacts.columns[name]
             set_column_length(self.engine, col, clen)
 
         if len(vi_objs) > 0:
-            self.__insert(vi_objs, self.metadata.tables['variant_impacts'].insert())
+            self.__insert(vi_objs, self.metadata.tables['variant_impacts'])
+
 
+    def insert_concurrently(self, vlengths, v_objs, vilengths, vi_objs, expanded, sparse_rows):
+        for name, clen in vlengths.items():
+            set_column_length(self.engine, self.variants.columns[name], clen)
+        for name, clen in vilengths.items():
+            set_column_length(self.engine, self.variant_impacts.columns[name], clen)
 
-    def __insert(self, objs, stmt):
+        tables = [(self.variants, v_objs), (self.variant_impacts, vi_objs)]
+        tables.extend((self.metadata.tables["sample_" + k], expanded[k]) for k in expanded)
+        if self.sparse_info is not None:
+            tables.append((self.sparse_table, sparse_rows))
+        tables = [(t, objs) for t, objs in tables if len(objs) > 0]
+        try:
+            self.writer.insert_tables(tables, self.writer_pool)
+        except PartialCommitError:
+            # retrying would duplicate the rows that were committed.
+            raise
+        except Exception as e:
+            # nothing was committed so redo the chunk one table at a time which reports any bad record.
+            sys.stderr.write("concurrent insert failed (%s). retrying the chunk sequentially\n" % e)
+            for t, objs in tables:
+                self.__insert(objs, t)
+
+    def add_foreign_keys(self):
+        "add the variant_id constraints that are left off the tables while they are written concurrently"
+        for name in ["variant_impacts"] + ["sample_" + k for k in self.expand]:
+            fk = sql.ForeignKeyConstraint(["variant_id"], [self.variants.c.variant_id],
+                                          name="fk_%s_variant_id" % name)
+            self.metadata.tables[name].append_constraint(fk)
+            self.engine.execute(sql.schema.AddConstraint(fk))
+
+    def __insert(self, objs, table):
 
         tx = time.time()
         # (2006, 'MySQL server has gone away'
@@ -418,8 +1446,10 @@ class VCFDB(object):
             for group in grouper(5000, objs):
                 g = list(group)
                 try:
-                    self.engine.execute(stmt, g)
+                    self.writer.insert(table, g)
                 except:
+                    # go through sqlalchemy one row at a time to report the bad record.
+                    stmt = table.insert()
                     with self.engine.begin() as trans:
                         for o in g:
                             try:
@@ -436,8 +1466,9 @@ class VCFDB(object):
                     raise
         else:
             try:
-                self.engine.execute(stmt, objs)
+                self.writer.insert(table, objs)
             except:
+                stmt = table.insert()
                 with self.engine.begin() as trans:
                     for o in objs:
                         trans.execute(stmt, o)
@@ -486,7 +1517,7 @@ class VCFDB(object):
                     break
 
     def _create_tables(self):
-        self.variant_impacts = sql.Table("variant_impacts", self.metadata, *self.variant_impacts_columns)
+        self.variant_impacts = self.variant_impacts_table()
         self.variant_impacts.drop(checkfirst=True)
 
         self.genotype_counts_table = sql.Table("sample_genotype_counts",
@@ -499,8 +1530,30 @@ class VCFDB(object):
         self.genotype_counts_table.drop(checkfirst=True)
         self.genotype_counts_table.create()
 
-        self.variants = sql.Table("variants", self.metadata, *self.variants_columns)
-        self.variants.drop(checkfirst=True)
+        self.sample_qc_table = sql.Table("sample_qc", self.metadata, *SampleQC.columns())
+        self.sample_qc_table.drop(checkfirst=True)
+        self.sample_qc_table.create()
+
+        def stored(c):
+            return sql.Column(c.name + "_blob_id", sql.Integer()) if c.name in self.dedup_cols else c
+
+        columns = [stored(c) for c in self.variants_columns
+                   if not (self.clustered and c.name in VCFDB.gt_cols) and not c.name in self.sparse_fields]
+        if self.dedup_cols:
+            self.blobs_table = sql.Table("genotype_blobs", self.metadata,
+                                         sql.Column("blob_id", sql.Integer(), primary_key=True),
+                                         sql.Column("blob", sql.LargeBinary()))
+            self.blobs_table.drop(checkfirst=True)
+            self.blobs_table.create()
+        # a previous load may have used another layout.
+        for name in ("variants", "variants_data", "variant_genotypes"):
+            drop_table_or_view(self.engine, name)
+        self.variants = sql.Table(self.variants_name, self.metadata, *columns)
+        if self.clustered:
+            # variant_id is the rowid so this is also clustered on it.
+            self.genotypes_table = sql.Table("variant_genotypes", self.metadata,
+                    sql.Column("variant_id", sql.Integer(), primary_key=True),
+                    *[stored(c) for c in self.variants_columns if c.name in VCFDB.gt_cols])
 
         version = sql.Table("version", self.metadata, sql.Column('version', sql.String(45)))
         version.drop(checkfirst=True)
@@ -516,10 +1569,81 @@ class VCFDB(object):
             self.engine.execute(t.insert(), {"feature": "snappy_compression"})
 
         self.variants.create()
+        if self.clustered:
+            self.genotypes_table.create()
+        if self.sparse_info is not None:
+            self.create_sparse_tables()
+        if self.genotype_bitmaps:
+            self.bitmaps_table = sql.Table("sample_genotype_bitmaps", self.metadata,
+                    sql.Column("sample_id", sql.Integer()),
+                    sql.Column("kind", sql.String(8)),
+                    sql.Column("first_variant_id", sql.Integer()),
+                    sql.Column("n_variants", sql.Integer()),
+                    sql.Column("bits", sql.LargeBinary()),
+                    sql.Index("idx_sample_genotype_bitmaps", "sample_id", "kind"))
+            self.bitmaps_table.drop(checkfirst=True)
+            self.bitmaps_table.create()
+        if self.variants_name != "variants":
+            self.create_variants_view()
         self.variant_impacts.create()
         self.create_vcf_header_table()
         self.create_expanded()
 
+    def create_sparse_tables(self):
+        info_fields = sql.Table("info_fields", self.metadata,
+                                sql.Column("field_id", sql.Integer(), primary_key=True),
+                                sql.Column("name", sql.TEXT()),
+                                sql.Column("info_id", sql.TEXT()),
+                                sql.Column("type", sql.String(20)))
+        kwargs = dict(sqlite_with_rowid=False) if self.clustered else {}
+        self.sparse_table = sql.Table("variant_info_sparse", self.metadata,
+                                      sql.Column("variant_id", sql.Integer(), primary_key=True),
+                                      sql.Column("field_id", sql.Integer(), primary_key=True, autoincrement=False),
+                                      sql.Column("value", sql.TEXT()), **kwargs)
+        for t in (info_fields, self.sparse_table):
+            t.drop(checkfirst=True)
+            t.create()
+        types = {c.name: str(c.type) for c in self.variants_columns}
+        if len(self.sparse_fields) > 0:
+            self.engine.execute(info_fields.insert(), [
+                dict(field_id=field_id, name=name, info_id=self.info_ids[name], type=types[name])
+                for name, field_id in sorted(self.sparse_fields.items())])
+
+    def create_variants_view(self, columns=None):
+        """
+        create a `variants` view over variants_data with the usual columns so
+        that queries are unchanged. The genotype columns are joined back in from
+        variant_genotypes, dedup'ed blobs from genotype_blobs and sparse INFO
+        fields are cast from variant_info_sparse.
+        columns defaults to variants_columns.
+        """
+        data = self.variants
+        cols, joined = [], data
+        if self.clustered:
+            genotypes = self.genotypes_table
+            joined = joined.outerjoin(genotypes, genotypes.c.variant_id == data.c.variant_id)
+        for c in columns or self.variants_columns:
+            src = genotypes if self.clustered and c.name in VCFDB.gt_cols else data
+            if c.name in self.dedup_cols:
+                blobs = self.blobs_table.alias("blobs_" + c.name)
+                joined = joined.outerjoin(blobs, blobs.c.blob_id == src.c[c.name + "_blob_id"])
+                cols.append(blobs.c.blob.label(c.name))
+            elif c.name in self.sparse_fields:
+                sparse = self.sparse_table
+                # values are stored as TEXT so don't cast to (and truncate at) the sampled width.
+                typ = sql.TEXT() if isinstance(c.type, sql.String) else c.type
+                value = sql.select([sql.cast(sparse.c.value, typ)]).where(
+                        sql.and_(sparse.c.variant_id == data.c.variant_id,
+                                 sparse.c.field_id == self.sparse_fields[c.name])).as_scalar()
+                if c.default is not None and c.default.is_scalar:
+                    value = sql.func.coalesce(value, c.default.arg)
+                cols.append(value.label(c.name))
+            else:
+                cols.append(src.c[c.name])
+        q = sql.select(cols).select_from(joined)
+        self.engine.execute("CREATE VIEW variants AS %s" %
+                            q.compile(dialect=self.engine.dialect, compile_kwargs={"literal_binds": True}))
+
     def create_expanded(self):
         """
         We store the sample fields, e.g. depths and genotypes in a serialized
@@ -529,16 +1653,22 @@ class VCFDB(object):
         for field in self.expand:
             sql_type = GT_TYPE_LOOKUP[field]
             name = "sample_%s" % field
-            cols = [sql.Column('variant_id', sql.Integer,
-                               sql.ForeignKey('variants.variant_id'),
-                               nullable=False, primary_key=False)]
+            cols = [self.variant_id_column()]
             cols.extend([sql.Column("sample_" + s, sql_type, index=True) for s in self.samples])
             t = sql.Table(name, self.metadata, *cols)
             t.drop(self.engine, checkfirst=True)
             t.create()
 
-    def create_vcf_header_table(self):
-        h = self.vcf.raw_header
+    @property
+    def raw_header(self):
+        "the full header of the VCF or the merged header of all of the VCFs."
+        if not hasattr(self, "_raw_header"):
+            self._raw_header = merge_headers([cyvcf2.VCF(p).raw_header for p in self.vcf_paths])
+        return self._raw_header
+
+    def create_vcf_header_table(self, h=None):
+        if h is None:
+            h = self.raw_header
         t = sql.Table("vcf_header", self.metadata,
                       #sql.Column("vcf_header", sql.TEXT(len(h)))
                       sql.Column("vcf_header", sql.TEXT)
@@ -547,15 +1677,34 @@ class VCFDB(object):
         t.create()
         self.engine.execute(t.insert(), [dict(vcf_header=h.rstrip())])
 
+    def variant_id_column(self):
+        """
+        variant_id referencing variants. The constraint is added after the load
+        when the tables are written concurrently (see add_foreign_keys).
+        """
+        fk = [] if self.writer_pool is not None else [sql.ForeignKey(self.variants_name + ".variant_id")]
+        return sql.Column("variant_id", sql.Integer, *fk, nullable=False, primary_key=False)
+
     def get_variant_impacts_columns(self):
-        return [sql.Column("variant_id", sql.Integer,
-                           sql.ForeignKey("variants.variant_id"), nullable=False),
-                ] + self.variants_gene_columns() + list(self.get_extra_cols())
+        if self.clustered:
+            key = [sql.Column("variant_id", sql.Integer, sql.ForeignKey(self.variants_name + ".variant_id"),
+                              primary_key=True),
+                   sql.Column("ordinal", sql.Integer, primary_key=True, autoincrement=False)]
+        else:
+            key = [self.variant_id_column()]
+        return key + self.variants_gene_columns() + list(self.get_extra_cols())
+
+    def variant_impacts_table(self):
+        if self.clustered:
+            return sql.Table("variant_impacts", self.metadata, *self.variant_impacts_columns,
+                             sqlite_with_rowid=False)
+        return sql.Table("variant_impacts", self.metadata, *self.variant_impacts_columns)
 
     def index(self):
         sys.stderr.write("indexing ... ")
         t0 = time.time()
         sql.Index("idx_variants_chrom_start", self.variants.c.chrom, self.variants.c.start).create()
+        sql.Index("idx_variants_chrom_bin", self.variants.c.chrom, self.variants.c.bin).create()
         sql.Index("idx_variants_exonic", self.variants.c.is_exonic).create()
         sql.Index("idx_variants_coding", self.variants.c.is_coding).create()
         sql.Index("idx_variants_impact", self.variants.c.impact).create()
@@ -631,6 +1780,7 @@ class VCFDB(object):
             sql.Column("chrom", sql.String(10)),
             sql.Column("start", sql.Integer()),
             sql.Column("end", sql.Integer()),
+            sql.Column("bin", sql.Integer()),
             sql.Column("vcf_id", sql.String(12)),
             #sql.Column("anno_id", Integer()),
             sql.Column("ref", sql.TEXT()),
@@ -695,7 +1845,8 @@ class VCFDB(object):
                ]
 
     def variants_genotype_columns(self):
-        return [sql.Column(name, sql.LargeBinary()) for name in self.gt_cols]
+        # skipped columns are kept (as NULL) so gemini sees the usual schema.
+        return [sql.Column(name, sql.LargeBinary()) for name in VCFDB.gt_cols]
 
     def update_impacts_headers(self, hdr_dict):
         """keep the description so we know how to parse the CSQ/ANN fields"""
@@ -717,7 +1868,7 @@ class VCFDB(object):
     def header_infos(self):
         if hasattr(self, "_header_infos"):
             return self._header_infos
-        raw_header = self.vcf.raw_header
+        raw_header = self.raw_header
         self._header_infos = []
         for l in (x.strip() for x in from_bytes(raw_header).split("\n")):
             if not l.startswith("##INFO"):
@@ -774,11 +1925,234 @@ class VCFDB(object):
             col, cid, af_col, stringer = self.type_for_field(d)
             if col is None: continue
             if af_col: self.af_cols.append(cid)
+            self.info_ids[cid] = d["ID"]
             if stringer: self.stringers.append(d["ID"])
             yield col
 
         self.stringers = set(self.stringers)
 
+# UCSC binning scheme; the extended bins are for coordinates past 512Mb.
+BIN_OFFSETS = (4096 + 512 + 64 + 8 + 1, 512 + 64 + 8 + 1, 64 + 8 + 1, 8 + 1, 1, 0)
+BIN_FIRST_SHIFT, BIN_NEXT_SHIFT = 17, 3
+BIN_EXTENDED_START, BIN_EXTENDED_OFFSET = 1 << 29, 4681
+
+def ucsc_bin(start, end):
+    """
+    UCSC bin of the (0-based, half-open) interval for scalars or arrays.
+    >>> ucsc_bin(0, 1)
+    585
+    >>> ucsc_bin(0, 200000)
+    73
+    >>> ucsc_bin([0, 1 << 17], [1, 1 << 18]).tolist()
+    [585, 586]
+    """
+    scalar = np.isscalar(start)
+    start = np.atleast_1d(np.asarray(start, dtype=np.int64))
+    end = np.maximum(np.atleast_1d(np.asarray(end, dtype=np.int64)) - 1, start)
+    extended = end >= BIN_EXTENDED_START
+
+    bins = np.full(start.shape, -1, dtype=np.int64)
+    for ext, offsets in ((extended, BIN_OFFSETS), (~extended, BIN_OFFSETS[1:])):
+        sbin, ebin = start[ext] >> BIN_FIRST_SHIFT, end[ext] >> BIN_FIRST_SHIFT
+        b = bins[ext]
+        for offset in offsets:
+            found = (b == -1) & (sbin == ebin)
+            b[found] = offset + sbin[found]
+            sbin, ebin = sbin >> BIN_NEXT_SHIFT, ebin >> BIN_NEXT_SHIFT
+        if offsets is BIN_OFFSETS:
+            b += BIN_EXTENDED_OFFSET
+        bins[ext] = b
+    return int(bins[0]) if scalar else bins
+
+def overlapping_bins(start, end):
+    """
+    list of (lo, hi) bin ranges that may hold intervals overlapping start, end.
+    >>> overlapping_bins(0, 1)[:5]
+    [(585, 585), (73, 73), (9, 9), (1, 1), (0, 0)]
+    """
+    end = max(end - 1, start)
+    ranges = []
+    for extended in (0, BIN_EXTENDED_OFFSET):
+        offsets = BIN_OFFSETS if extended else BIN_OFFSETS[1:]
+        shift = BIN_FIRST_SHIFT
+        for offset in offsets:
+            ranges.append((extended + offset + (start >> shift), extended + offset + (end >> shift)))
+            shift += BIN_NEXT_SHIFT
+    return ranges
+
+def region_where(chrom, start, end, dialect=None):
+    """
+    SQL where clause for variants overlapping chrom:start-end (0-based,
+    half-open) that uses the (chrom, bin) index. The identifiers (e.g. "end",
+    which is reserved in PostgreSQL) are quoted for the dialect, e.g.
+    engine.dialect, which defaults to sqlite.
+    >>> region_where("1", 0, 1)[:33]
+    "chrom = '1' AND (bin = 585 OR bin"
+    >>> region_where("1", 0, 1)[-27:]
+    'AND start < 1 AND "end" > 0'
+    """
+    col = sql.column
+    bins = [col("bin") == lo if lo == hi else col("bin").between(lo, hi)
+            for lo, hi in overlapping_bins(int(start), int(end))]
+    clause = sql.and_(col("chrom") == str(chrom), sql.or_(*bins), col("start") < int(end), col("end") > int(start))
+    if dialect is None:
+        from sqlalchemy.dialects import sqlite
+        dialect = sqlite.dialect()
+    return str(clause.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+
+def genotype_bitmap_query(engine, het=(), hom_alt=(), called=()):
+    """
+    return the variant_ids where all samples in `het` are HET, all in `hom_alt`
+    are HOM_ALT and all in `called` have a called genotype. Samples are given
+    by name. This uses the sample_genotype_bitmaps table from a load with
+    --genotype-bitmaps so no genotype blobs are decoded.
+    """
+    if isinstance(engine, basestring):
+        engine = sql.create_engine(get_dburl(engine))
+    sample_ids = {name: sid for sid, name in engine.execute("select sample_id, name from samples")}
+    wanted = [(s, "het") for s in het] + [(s, "hom_alt") for s in hom_alt] + [(s, "called") for s in called]
+    if len(wanted) == 0:
+        raise ValueError("must specify at least one sample")
+
+    qry = sql.text("select first_variant_id, n_variants, bits from sample_genotype_bitmaps "
+                   "where sample_id = :sample_id and kind = :kind")
+    result = None
+    for sample, kind in wanted:
+        chunks = {}
+        for first, n, bits in engine.execute(qry, sample_id=sample_ids[sample], kind=kind):
+            chunks[first] = (n, np.frombuffer(zlib.decompress(bits), dtype=np.uint8))
+        if result is None:
+            result = chunks
+        else:
+            result = {f: (n, bits & chunks[f][1]) for f, (n, bits) in result.items()}
+
+    ids = [f + np.flatnonzero(np.unpackbits(bits)[:n]) for f, (n, bits) in sorted(result.items())]
+    return np.concatenate(ids).tolist() if ids else []
+
+def region_records(vcf, region):
+    "the records in region without the warning that cyvcf2 gives for a region with none"
+    records = vcf(region)
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="no intervals found")
+        first = next(records, None)
+    if first is None:
+        return
+    yield first
+    for v in records:
+        yield v
+
+def contigs_with_records(vcf):
+    "the contigs of an indexed VCF that have at least one record"
+    return [c for c in vcf.seqnames if next(region_records(vcf, c), None) is not None]
+
+def region_span(region, lengths):
+    """
+    (chrom, 0-based start, end) for a region given the contig lengths or None
+    if the end isn't known.
+    >>> region_span("chr1:1,001-2000", {"chr1": 5000}), region_span("chr2", {"chr2": 400})
+    (('chr1', 1000, 2000), ('chr2', 0, 400))
+    >>> region_span("chr1:101", {"chr1": 5000}), region_span("chr3", {"chr1": 5000})
+    (('chr1', 100, 5000), None)
+    """
+    if region in lengths:
+        return region, 0, lengths[region]
+    chrom, _, interval = region.rpartition(":")
+    start, _, end = interval.replace(",", "").partition("-")
+    if not chrom or not start.isdigit() or not (end or chrom in lengths):
+        return None
+    return chrom, int(start) - 1, int(end) if end else lengths[chrom]
+
+def vcf_paths(vcf_path):
+    """
+    a list of VCFs from a single path, a list of paths or a file ending in
+    .list, .txt or .fofn with one path per line.
+    """
+    if not isinstance(vcf_path, basestring):
+        return list(vcf_path)
+    if not vcf_path.endswith((".list", ".txt", ".fofn")):
+        return [vcf_path]
+    with open(vcf_path) as fh:
+        paths = [l.strip() for l in fh if l.strip() and not l.startswith("#")]
+    if len(paths) == 0:
+        raise Exception("no VCFs listed in %s" % vcf_path)
+    return paths
+
+def merge_headers(headers):
+    """
+    merge the header lines from multiple VCFs keeping the first of each
+    INFO/FORMAT/contig/... ID and the #CHROM line of the first VCF.
+    >>> merge_headers(["##INFO=<ID=A,Number=1>\\n#CHROM\\ts1\\n", "##INFO=<ID=A,Number=.>\\n##INFO=<ID=B,Number=1>\\n#CHROM\\ts1\\n"]).split("\\n")
+    ['##INFO=<ID=A,Number=1>', '##INFO=<ID=B,Number=1>', '#CHROM\\ts1', '']
+    """
+    if len(headers) == 1:
+        return headers[0]
+    lines, seen, chrom = [], set(), None
+    for h in headers:
+        for l in from_bytes(h).rstrip("\n").split("\n"):
+            if l.startswith("#CHROM"):
+                chrom = chrom or l
+                continue
+            key = l.split(",", 1)[0] if "=<ID=" in l else l
+            if key in seen: continue
+            seen.add(key)
+            lines.append(l)
+    return "\n".join(lines + [chrom]) + "\n"
+
+# set in the parent so that the forked workers in VCFDB.load_parallel have it.
+_spool_vcfdb = None
+
+def _init_spool_worker():
+    self = _spool_vcfdb
+    # the threads of the parent's pools don't survive the fork.
+    self.writer_pool = None
+    if self.blob_pool is not None:
+        self.blob_pool = ThreadPool(self.blob_threads)
+
+def _spool_vcf(args):
+    """
+    read, annotate and finish the chunks of a single VCF in a worker process
+    and pickle them to the spool file. The variant_ids start at 1 and are offset
+    by the parent, which also adds up the counts that are returned.
+    """
+    path, spool = args
+    self = _spool_vcfdb
+    # a worker may get several files; the parent merges the counts for each.
+    self.reset_counts()
+    n_variants, n_chunks = 0, 0
+    with open(spool, "wb") as fh:
+        for variants, expanded, keys, i in self.variant_chunks(self.records([path]), 1):
+            te = time.time()
+            variants, variant_impacts = self.annotate(variants, keys)
+            bitmaps = self.finish_chunk(variants, variant_impacts)
+            # buffers (e.g. from snappy_pack_blob) can't be pickled.
+            for v in variants:
+                for c in self.gt_cols:
+                    if isinstance(v[c], buffer):
+                        v[c] = bytes(v[c])
+            pickle.dump((variants, variant_impacts, expanded, bitmaps, time.time() - te), fh, pickle.HIGHEST_PROTOCOL)
+            n_variants, n_chunks = i, n_chunks + 1
+    return spool, n_variants, n_chunks, self.counts()
+
+def sparse_value(value, stringer, af):
+    """
+    the text stored in variant_info_sparse for an INFO value or None if it's
+    missing (or the default, which the view fills in).
+    >>> sparse_value(0.1, False, True), sparse_value(float('nan'), False, True), sparse_value(True, False, False)
+    ('0.1', None, '1')
+    >>> sparse_value('D', True, False), sparse_value('', False, True)
+    ('D', None)
+    """
+    if value is None or value is False or (af and value == ""):
+        return None
+    if stringer or value.__class__ in (list, tuple):
+        return encode(value)
+    if value is True:
+        return "1"
+    if isinstance(value, float):
+        # repr so that the CAST in the view gives back the same double.
+        return None if np.isnan(value) else repr(value)
+    return to_ascii(value) if isinstance(value, basestring) else str(value)
+
 def af_like(cid):
     return cid.endswith(("_af", "_aaf")) or cid.startswith(("af_", "aaf_", "an_")) or "_aaf_" in cid or "_af_" in cid
 
@@ -797,10 +2171,34 @@ KEY_2_CLASS = {
         'BCSQ': geneimpacts.BCFT,
         }
 
+IMPACT_SEVERITIES = ('LOW', 'MED', 'HIGH')
+
+def reduce_impacts(impacts, policy):
+    """
+    limit the impacts for a variant that are stored in variant_impacts.
+    policy is a dict with any of:
+       canonical_only: keep only canonical transcripts
+       protein_coding_only: keep only protein_coding biotypes
+       min_severity: keep impacts with at least this (LOW, MED or HIGH) severity
+       top: keep the N most severe impacts
+    """
+    if not policy:
+        return impacts
+    if policy.get('canonical_only'):
+        impacts = [i for i in impacts if i.is_canonical]
+    if policy.get('protein_coding_only'):
+        impacts = [i for i in impacts if i.biotype == "protein_coding"]
+    if policy.get('min_severity'):
+        keep = IMPACT_SEVERITIES[IMPACT_SEVERITIES.index(policy['min_severity']):]
+        impacts = [i for i in impacts if i.effect_severity in keep]
+    if policy.get('top') and len(impacts) > policy['top']:
+        impacts = sorted(impacts)[::-1][:policy['top']]
+    return impacts
+
 def gene_info(d_and_impacts_headers):
     # this is parallelized as it's only simple objects and the gene impacts
     # stuff is slow.
-    d, impacts_headers, blobber, gt_cols, req_cols, has_samples, stringers, extra_columns, impacts_extras = d_and_impacts_headers
+    d, impacts_headers, req_cols, has_samples, stringers, extra_columns, impacts_extras, impact_policy = d_and_impacts_headers
     impacts = []
     for k, cls in KEY_2_CLASS.items():
         if not k in d: continue
@@ -832,10 +2230,6 @@ def gene_info(d_and_impacts_headers):
     d['impact_so'] = top.so
     d['impact_severity'] = top.effect_severity
 
-    if has_samples:
-        for c in gt_cols:
-            d[c] = blobber(d[c])
-
     # add what we need.
     u = dict.fromkeys(req_cols)
     u.update(d)
@@ -850,6 +2244,8 @@ def gene_info(d_and_impacts_headers):
 
     d = u
     assert d['start'] is not None
+    # the variants columns above use the top impact over all of them.
+    impacts = reduce_impacts(impacts, impact_policy)
     gimpacts = []
     for impact in impacts:
         #gimpacts.append({k: getattr(impact, k) for k in keys})
@@ -886,6 +2282,178 @@ def encode(v):
             v = from_bytes(v)
     return v
 
+# the default SQLITE_MAX_ATTACHED; the attach script for shards must stay under it.
+SQLITE_MAX_ATTACHED = 10
+
+# variant_ids in shard k start at k * SHARD_ID_STRIDE + 1 so they are unique
+# across shards and any shard can be rebuilt without renumbering the others.
+SHARD_ID_STRIDE = 10**9
+
+def is_primary_contig(c):
+    """
+    >>> [is_primary_contig(c) for c in ("chr1", "X", "chrM", "GL000192.1", "chrUn_gl000220", "hs37d5")]
+    [True, True, True, False, False, False]
+    """
+    c = c[3:] if c.startswith("chr") else c
+    return c.isdigit() or c in ("X", "Y", "M", "MT")
+
+def shard_groups(vcf_path, n_shards=None):
+    """
+    return a list of (shard name, contigs) for the contigs with records in the
+    index. By default, each primary chromosome is a shard and the remaining
+    contigs (unplaced, decoys, ...) are in 'other'. With n_shards, the contigs
+    are packed into that many groups of similar length. There are at most
+    SQLITE_MAX_ATTACHED shards so that the attach script can query them all.
+    """
+    vcf = cyvcf2.VCF(vcf_path, samples=[], lazy=True)
+    # contigs without records would give empty shards.
+    contigs = contigs_with_records(vcf)
+    if len(contigs) == 0:
+        raise Exception("no records found in the index of %s" % vcf_path)
+    if n_shards is None:
+        groups = [(c, [c]) for c in contigs if is_primary_contig(c)]
+        other = [c for c in contigs if not is_primary_contig(c)]
+        if len(other) > 0:
+            groups.append(("other", other))
+        if len(groups) <= SQLITE_MAX_ATTACHED:
+            return groups
+        n_shards = SQLITE_MAX_ATTACHED
+        sys.stderr.write("sqlite can attach at most %d databases so the %d chromosomes are packed into %d shards\n"
+                         % (SQLITE_MAX_ATTACHED, len(groups), n_shards))
+    elif n_shards > SQLITE_MAX_ATTACHED:
+        sys.stderr.write("sqlite can attach at most %d databases so using %d shards\n"
+                         % (SQLITE_MAX_ATTACHED, SQLITE_MAX_ATTACHED))
+        n_shards = SQLITE_MAX_ATTACHED
+
+    try:
+        lengths = dict(zip(vcf.seqnames, vcf.seqlens))
+        lengths = {c: lengths[c] for c in contigs}
+    except Exception:
+        lengths = dict.fromkeys(contigs, 1)
+    totals, members = [0] * n_shards, [[] for _ in range(n_shards)]
+    for c in sorted(contigs, key=lambda c: -lengths[c]):
+        k = totals.index(min(totals))
+        totals[k] += lengths[c]
+        members[k].append(c)
+    order = {c: i for i, c in enumerate(contigs)}
+    members = sorted([sorted(m, key=order.get) for m in members if m], key=lambda m: order[m[0]])
+    return [("group%02d" % k, m) for k, m in enumerate(members, start=1)]
+
+def shard_path(db_path, name):
+    base, ext = os.path.splitext(db_path)
+    return "%s.%s%s" % (base, name, ext or ".db")
+
+def shard_attach_sql(manifest):
+    """
+    SQL that attaches each shard in the manifest and creates temporary views
+    that union each table across the shards. There are at most
+    SQLITE_MAX_ATTACHED shards (see shard_groups).
+    """
+    shards = manifest["shards"]
+    lines = ["-- from the directory containing the databases:",
+             "--   sqlite3 %s" % manifest["db"],
+             "--   sqlite> .read %s" % manifest["attach"]]
+    for k, shard in enumerate(shards):
+        lines.append("ATTACH DATABASE '%s' AS shard%d;" % (shard["path"], k))
+    for t in manifest["tables"]:
+        union = "\n    UNION ALL ".join("SELECT * FROM shard%d.%s" % (k, t) for k in range(len(shards)))
+        lines.append("CREATE TEMP VIEW %s AS\n    %s;" % (t, union))
+    return "\n".join(lines) + "\n"
+
+def copy_table(src, dst, name, rows=None):
+    """create table `name` from the src engine in the dst engine and copy the rows (or insert `rows`)."""
+    t = sql.Table(name, sql.MetaData(bind=src), autoload=True)
+    t.drop(dst, checkfirst=True)
+    t.create(dst)
+    if rows is None:
+        rows = [dict(r) for r in src.execute(t.select())]
+    if len(rows) > 0:
+        dst.execute(t.insert(), rows)
+
+def _load_shard(args):
+    vcf_path, db_path, ped_path, regions, start, kwargs = args
+    VCFDB(vcf_path, db_path, ped_path, regions=regions, variant_id_start=start, **kwargs)
+
+def load_shards(vcf_path, db_path, ped_path=None, n_shards=None, processes=1, only=None, **kwargs):
+    """
+    write one sqlite database per chromosome (or per contig group if n_shards
+    is given) to <db>.<shard>.db. The VCF must be indexed. The shards can be
+    loaded in parallel with `processes`. db_path gets the samples, vcf_header
+    and merged sample_genotype_counts and sample_qc tables and we write <db>.manifest.json
+    describing the shards and <db>.attach.sql to query across them.
+    `only` is a list of shard or contig names to rebuild in an existing set.
+    """
+    if db_path.startswith("sqlite:///"):
+        db_path = db_path[len("sqlite:///"):]
+    if get_dburl(db_path) != "sqlite:///" + db_path:
+        raise Exception("sharded output is only supported for sqlite")
+    if len(vcf_paths(vcf_path)) > 1:
+        raise Exception("sharded output requires a single VCF")
+    base, d = os.path.splitext(db_path)[0], os.path.dirname(db_path)
+
+    manifest = {"vcf": vcf_path, "db": os.path.basename(db_path),
+                "attach": os.path.basename(base + ".attach.sql"),
+                "id_stride": SHARD_ID_STRIDE, "shards": [],
+                "tables": ["variants", "variant_impacts"] + ["sample_" + e for e in kwargs.get("expand") or []] +
+                          (["gene_summary"] if kwargs.get("gene_summary") else [])}
+    for k, (name, contigs) in enumerate(shard_groups(vcf_path, n_shards)):
+        manifest["shards"].append({"name": name, "contigs": contigs,
+                                   "path": os.path.basename(shard_path(db_path, name)),
+                                   "first_variant_id": k * SHARD_ID_STRIDE + 1})
+
+    todo = manifest["shards"]
+    if only:
+        only = set(only)
+        with open(base + ".manifest.json") as fh:
+            old = json.load(fh)
+        if [(x["name"], x["contigs"]) for x in old["shards"]] != [(x["name"], x["contigs"]) for x in todo]:
+            raise Exception("the shard layout differs from %s.manifest.json. all shards must be rebuilt" % base)
+        todo = [x for x in todo if x["name"] in only or only.intersection(x["contigs"])]
+        if len(todo) == 0:
+            raise Exception("no shards found matching: %s" % ",".join(sorted(only)))
+
+    args = [(vcf_path, os.path.join(d, x["path"]), ped_path, x["contigs"], x["first_variant_id"], kwargs)
+            for x in todo]
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        list(pool.imap_unordered(_load_shard, args))
+        pool.close()
+        pool.join()
+    else:
+        for a in args:
+            _load_shard(a)
+
+    # shared tables go in the main database with the genotype counts summed over shards.
+    engine = sql.create_engine(get_dburl(db_path), poolclass=sql.pool.NullPool)
+    counts = None
+    for shard in manifest["shards"]:
+        e = sql.create_engine(get_dburl(os.path.join(d, shard["path"])), poolclass=sql.pool.NullPool)
+        shard["n_variants"], = e.execute("select count(*) from variants").fetchone()
+        c = np.array(e.execute("select sample_id, num_hom_ref, num_het, num_hom_alt, num_unknown "
+                               "from sample_genotype_counts order by sample_id").fetchall(), dtype=np.int64)
+        if counts is None:
+            counts, first = c, e
+        else:
+            counts[:, 1:] += c[:, 1:]
+
+    shared = set(sql.inspect(first).get_table_names())
+    for name in ("samples", "vcf_header", "version", "features"):
+        if name in shared:
+            copy_table(first, engine, name)
+    copy_table(first, engine, "sample_genotype_counts", rows=[
+        dict(zip(("sample_id", "num_hom_ref", "num_het", "num_hom_alt", "num_unknown"), map(int, r)))
+        for r in counts])
+    qc = SampleQC(len(counts))
+    for shard in manifest["shards"]:
+        qc.add_table(sql.create_engine(get_dburl(os.path.join(d, shard["path"])), poolclass=sql.pool.NullPool))
+    copy_table(first, engine, "sample_qc", rows=qc.rows())
+
+    with open(base + ".manifest.json", "w") as fh:
+        json.dump(manifest, fh, indent=2)
+    with open(base + ".attach.sql", "w") as fh:
+        fh.write(shard_attach_sql(manifest))
+    return manifest
+
 if __name__ == "__main__":
 
     import doctest
@@ -893,7 +2461,8 @@ if __name__ == "__main__":
 
     import argparse
     p = argparse.ArgumentParser(__doc__)
-    p.add_argument("VCF")
+    p.add_argument("VCF", nargs="+", help="one or more VCFs with the same samples or a file " \
+                   "ending in .list, .txt or .fofn with one VCF per line")
     p.add_argument("ped")
     p.add_argument("db")
     p.add_argument("--a-ok", action='append', default=[],
@@ -905,7 +2474,68 @@ if __name__ == "__main__":
             "to the variant_impacts table. by default, only CSQ/EFF/ANN fields are added. "
             "the field can be suffixed with a type of ':i' or ':f' to indicate int or float to "
             "override the default of string. e.g. AF:f ")
+    p.add_argument("--impacts-canonical-only", action='store_true', default=False,
+                   help="only store impacts on canonical transcripts in variant_impacts")
+    p.add_argument("--impacts-protein-coding-only", action='store_true', default=False,
+                   help="only store impacts on protein_coding transcripts in variant_impacts")
+    p.add_argument("--impacts-min-severity", choices=IMPACT_SEVERITIES,
+                   help="only store impacts with at least this severity in variant_impacts")
+    p.add_argument("--impacts-top", type=int,
+                   help="only store the N most severe impacts for each variant in variant_impacts")
+    p.add_argument("--vcf-processes", type=int, default=1,
+                   help="when loading multiple VCFs, annotate up to this many in parallel. " \
+                        "the annotated chunks are spooled to TMPDIR")
+    p.add_argument("--writer-threads", type=int, default=1,
+                   help="write variants, variant_impacts and the --expand'ed tables concurrently, each on " \
+                        "its own connection (not for sqlite). foreign keys are added after the load.")
+    p.add_argument("--clustered", action='store_true', default=False,
+                   help="sqlite only: store variant_impacts WITHOUT ROWID clustered on variant_id and the " \
+                        "genotype blobs in variant_genotypes. variants is a view with the usual columns.")
+    p.add_argument("--sparse-info", type=float,
+                   help="store INFO fields that are set in fewer than this fraction of the sampled variants " \
+                        "in variant_info_sparse instead of as columns. variants is a view with all of the columns.")
+    p.add_argument("--gene-summary", action='store_true', default=False,
+                   help="write a gene_summary table with per-gene variant counts by severity, LoF counts " \
+                        "and per-sample carrier counts")
     p.add_argument("--legacy-compression", action='store_true', default=False)
+    p.add_argument("--batch-size", type=int, default=10000,
+                   help="maximum number of variants to insert at once")
+    p.add_argument("--batch-bytes", type=parse_size, default="512M",
+                   help="also flush a batch when its estimated size reaches this many bytes (e.g. 512M)")
+    p.add_argument("--max-memory", type=parse_size,
+                   help="target RSS (e.g. 8G). the batch size is reduced while the process is over this.")
+
+    p.add_argument("--schema-sample", type=int, default=10000,
+                   help="number of variants (INFO only) to sample to size the string columns. if the " \
+                        "VCF is indexed, these are spread across the genome.")
+    p.add_argument("--schema-cache", default=os.path.expanduser("~/.cache/vcf2db"),
+                   help="directory of column widths learned from VCFs with the same INFO header. with a " \
+                        "cached schema the --schema-sample step is skipped. (default: %(default)s)")
+    p.add_argument("--no-schema-cache", action='store_true', default=False,
+                   help="neither use nor update the schema cache")
+    p.add_argument("--update-annotations", choices=("position", "order"),
+                   help="update the INFO and gene columns and variant_impacts of an existing " \
+                        "database from a re-annotated VCF without reloading the genotypes. " \
+                        "variants are matched by (chrom, start, ref, alt) or by their order in the VCF.")
+
+    p.add_argument("--reader-threads", type=int,
+                   help="number of htslib threads to use for decompressing the VCF")
+    p.add_argument("--skip-gt-col", action='append', default=[],
+                   choices=[c for c in VCFDB.gt_cols if c != "gt_types"],
+                   help="don't decode this sample field from the VCF; the column will be NULL. " \
+                        "May be specified multiple times.")
+
+    p.add_argument("--blob-threads", type=int, default=1,
+                   help="number of threads used to compress the genotype columns")
+
+    p.add_argument("--dedup-blob", action='append', default=[], choices=VCFDB.gt_cols,
+                   help="store each distinct blob for this sample column once in a genotype_blobs table; " \
+                        "variants becomes a view. useful for sparse or small-cohort VCFs. " \
+                        "May be specified multiple times.")
+
+    p.add_argument("--genotype-bitmaps", action='store_true', default=False,
+                   help="store per-sample het/hom-alt/called bitmaps in sample_genotype_bitmaps " \
+                        "for fast multi-sample genotype queries with genotype_bitmap_query")
 
     p.add_argument("--expand",
                    action='append',
@@ -913,9 +2543,39 @@ if __name__ == "__main__":
                    help="sample columns to expand into their own tables",
                    choices=GT_TYPE_LOOKUP.keys())
 
+    p.add_argument("--shards",
+                   help="write one sqlite database per chromosome ('chrom') or per N contig groups " \
+                        "(an integer) along with a manifest and an ATTACH script. requires an indexed VCF.")
+    p.add_argument("--shard-processes", type=int, default=1,
+                   help="number of shards to build in parallel")
+    p.add_argument("--only-shards",
+                   help="comma-separated shard or contig names to rebuild in an existing set of shards")
+
     a = p.parse_args()
 
     main_blobber = pack_blob if a.legacy_compression else snappy_pack_blob
 
-    VCFDB(a.VCF, a.db, a.ped, black_list=a.info_exclude, expand=a.expand, blobber=main_blobber,
-          impacts_extras=a.impacts_field, aok=a.a_ok)
+    kwargs = dict(black_list=a.info_exclude, expand=a.expand, blobber=main_blobber,
+                  impacts_extras=a.impacts_field, aok=a.a_ok, batch_size=a.batch_size,
+                  batch_bytes=a.batch_bytes, max_memory=a.max_memory,
+                  schema_sample=a.schema_sample, reader_threads=a.reader_threads,
+                  skip_gt_cols=a.skip_gt_col, blob_threads=a.blob_threads,
+                  dedup_blobs=a.dedup_blob, genotype_bitmaps=a.genotype_bitmaps,
+                  impact_policy=dict(canonical_only=a.impacts_canonical_only,
+                                     protein_coding_only=a.impacts_protein_coding_only,
+                                     min_severity=a.impacts_min_severity,
+                                     top=a.impacts_top),
+                  gene_summary=a.gene_summary,
+                  schema_cache=None if a.no_schema_cache else a.schema_cache,
+                  writer_threads=a.writer_threads, clustered=a.clustered, sparse_info=a.sparse_info)
+    if len(a.VCF) == 1:
+        a.VCF = a.VCF[0]
+    if a.shards and a.update_annotations:
+        p.error("--update-annotations can't be used with --shards; update each shard database instead")
+    if a.shards:
+        load_shards(a.VCF, a.db, a.ped, n_shards=None if a.shards == "chrom" else int(a.shards),
+                    processes=a.shard_processes,
+                    only=a.only_shards.split(",") if a.only_shards else None, **kwargs)
+    else:
+        VCFDB(a.VCF, a.db, a.ped, update_annotations=a.update_annotations,
+              vcf_processes=a.vcf_processes, **kwargs)